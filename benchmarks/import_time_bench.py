@@ -0,0 +1,48 @@
+import os.path as osp
+import subprocess
+import sys
+
+ROOT_DIR = osp.dirname(osp.dirname(osp.abspath(__file__)))
+
+# Milliseconds allowed for a cold import of each module in a fresh interpreter. Modules that feature
+# extraction or prediction workers import must not pull nltk, sklearn, matplotlib or spotipy in at import time,
+# pandas is imported at the top like everywhere else.
+IMPORT_BUDGETS_MS = {
+    "utils.general_utls": 700,
+    "utils.lyrics_utils": 750,
+    "utils.fetch_utils": 900,
+    "utils.spotify_utils": 800,
+    "utils.batch_utils": 800,
+    "utils.curation_utils": 800,
+    "utils.ml_utils": 800,
+    "utils.plot_utils": 900,
+    "utils.inference_utils": 900,
+    "utils.text_features_utils": 900,
+}
+
+
+def measure_import_ms(module_name, repeat=3):
+    # Best of `repeat` fresh interpreters, -X importtime reports the module's cumulative import time last
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                                cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+        last_line = result.stderr.strip().splitlines()[-1]
+        timings.append(int(last_line.split("|")[1]) / 1000)
+    return min(timings)
+
+
+def run_benchmark(budgets=None, repeat=3):
+    over_budget = {}
+    for module_name, budget_ms in (budgets or IMPORT_BUDGETS_MS).items():
+        import_ms = measure_import_ms(module_name, repeat)
+        status = "OK" if import_ms <= budget_ms else "OVER BUDGET"
+        print(f"{module_name}: {import_ms:.0f}ms (BUDGET {budget_ms}ms) {status}")
+        if import_ms > budget_ms:
+            over_budget[module_name] = import_ms
+
+    return over_budget
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run_benchmark() else 0)
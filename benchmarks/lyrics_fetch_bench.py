@@ -0,0 +1,71 @@
+import tempfile
+import os.path as osp
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.fetch_utils import LyricsFetcher
+
+STUB_PAGE = (
+    "<html><head><title>Stub lyrics</title></head><body><div id='header'>not lyrics</div>"
+    "<div data-lyrics-container='true'>[Verse 1]<br/>First line of the stub<br/>Second <i>line</i><br/><br/>"
+    "<a href='#'><span>Annotated line</span></a><br/>[Chorus]<br/>La la la</div>"
+    "<div data-lyrics-container='true'>[Verse 2]<br/>Another line<br/>And the last one</div>"
+    "</body></html>"
+).encode()
+
+
+class StubGeniusHandler(BaseHTTPRequestHandler):
+    # Every `fail_every`-th request is answered with 429 to exercise the retry path
+    fail_every = 0
+    request_cnt = 0
+    lock = threading.Lock()
+    latency = 0.0
+
+    def do_GET(self):
+        with StubGeniusHandler.lock:
+            StubGeniusHandler.request_cnt += 1
+            should_fail = self.fail_every and StubGeniusHandler.request_cnt % self.fail_every == 0
+        time.sleep(self.latency)
+        if should_fail:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(STUB_PAGE)))
+        self.end_headers()
+        self.wfile.write(STUB_PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(latency=0.02, fail_every=0):
+    StubGeniusHandler.latency = latency
+    StubGeniusHandler.fail_every = fail_every
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGeniusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_benchmark(pages=200, concurrency=16, rate=1000.0, latency=0.02, fail_every=10):
+    server = start_stub_server(latency, fail_every)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    fetcher = LyricsFetcher(concurrency=concurrency, rate=rate, backoff=0.01)
+    with tempfile.TemporaryDirectory() as out_dir:
+        pairs = [(f"{base_url}/song-{i}-lyrics", osp.join(out_dir, f"song-{i}.txt")) for i in range(pages)]
+        start = time.perf_counter()
+        saved = fetcher.fetch_and_save_many(pairs)
+        elapsed = time.perf_counter() - start
+
+    fetcher.close()
+    server.shutdown()
+    print(f"SAVED {sum(saved.values())}/{pages} PAGES IN {elapsed:.2f}s ({pages / elapsed:.1f} pages/sec), "
+          f"{StubGeniusHandler.request_cnt} REQUESTS")
+    return {"pages": pages, "seconds": elapsed, "pages_per_sec": pages / elapsed}
+
+
+if __name__ == '__main__':
+    run_benchmark()
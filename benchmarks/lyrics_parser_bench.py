@@ -0,0 +1,114 @@
+import glob
+import html
+import json
+import os
+import os.path as osp
+import sys
+import time
+from utils.general_utls import is_file_valid
+from utils.lyrics_utils import parse_lyrics_html, parse_lyrics_html_bs4
+
+ROOT_DIR = osp.dirname(osp.dirname(osp.abspath(__file__)))
+LYRICS_DIR = osp.join(ROOT_DIR, "song_lyrics")
+FIXTURES_DIR = osp.join(ROOT_DIR, "benchmarks", "fixtures", "genius_pages")
+
+# Genius pages carry a few hundred KB of scripts and markup around the lyrics, the generated pages mimic that
+PAGE_HEAD = (
+    "<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\"/><title>{title} | Genius Lyrics</title>"
+    "<script>window.__PRELOADED_STATE__ = JSON.parse('{state}');</script></head><body><div id=\"application\">"
+    "<main class=\"SongPage__Container\"><h1 class=\"SongHeaderdesktop__Title\"><span>{title}</span></h1>"
+    "<div id=\"lyrics-root\" class=\"Lyrics__Root-sc-1ynbvzw-0\">"
+)
+CONTAINER = "<div data-lyrics-container=\"true\" class=\"Lyrics__Container-sc-1ynbvzw-1 kUgSbL\">{body}</div>"
+ANNOTATION = ("<a href=\"/annotation\" class=\"ReferentFragmentdesktop__ClickTarget-sc-110r0d9-0\">"
+              "<span class=\"ReferentFragmentdesktop__Highlight-sc-110r0d9-1\">{line}</span></a>")
+AD_SLOT = "<div class=\"RightSidebar__Container\"><div class=\"DfpAd__Container\" data-exclude=\"true\"></div></div>"
+PAGE_TAIL = (
+    "</div></main><footer class=\"PageFooterdesktop__Container\">{footer}</footer>"
+    "<script>window.dataLayer = window.dataLayer || [];</script></div></body></html>"
+)
+STATE_SIZE = 200000
+
+
+def fixture_expected_path(page_path):
+    return page_path[:-len(".html")] + ".expected.json"
+
+
+def update_fixtures(fixtures_dir=FIXTURES_DIR):
+    # Records the BeautifulSoup output of every fixture page as its expected output
+    for page_path in sorted(glob.glob(osp.join(fixtures_dir, "*.html"))):
+        with open(page_path, 'rb') as fp:
+            expected = parse_lyrics_html_bs4(fp.read())
+        with open(fixture_expected_path(page_path), 'w', encoding='utf-8') as fp:
+            json.dump(expected, fp, ensure_ascii=False, indent=2)
+    print(f"UPDATED FIXTURES IN {fixtures_dir}")
+
+
+def verify_fixtures(fixtures_dir=FIXTURES_DIR):
+    mismatches = []
+    page_paths = sorted(glob.glob(osp.join(fixtures_dir, "*.html")))
+    for page_path in page_paths:
+        with open(page_path, 'rb') as fp:
+            html_content = fp.read()
+        with open(fixture_expected_path(page_path), encoding='utf-8') as fp:
+            expected = json.load(fp)
+        if parse_lyrics_html(html_content) != expected:
+            mismatches.append(osp.basename(page_path))
+
+    print(f"FIXTURES: {len(page_paths) - len(mismatches)}/{len(page_paths)} IDENTICAL")
+    for name in mismatches:
+        print(f"  MISMATCH: {name}")
+    return mismatches
+
+
+def build_page(title, lyrics_text):
+    lines = [html.escape(line) for line in lyrics_text.splitlines()]
+    if len(lines) > 4:
+        lines[3] = ANNOTATION.format(line=lines[3])
+    half = len(lines) // 2
+    containers = [CONTAINER.format(body="<br/>".join(part)) for part in (lines[:half], lines[half:]) if part]
+    state = ("\\\"lyrics\\\":\\\"" + "<br>".join(lines[:8]).replace("'", "\\'") + "\\\",") * (
+        STATE_SIZE // (len(lyrics_text[:400]) + 20) + 1)
+    return (PAGE_HEAD.format(title=html.escape(title), state=state[:STATE_SIZE]) + AD_SLOT.join(containers) +
+            PAGE_TAIL.format(footer="Genius is the world's biggest collection of song lyrics")).encode()
+
+
+def build_pages(lyrics_dir=LYRICS_DIR, limit=300):
+    lyrics_files = [osp.join(lyrics_dir, f) for f in sorted(os.listdir(lyrics_dir))]
+    pages = []
+    for lyrics_file in [f for f in lyrics_files if is_file_valid(f)][:limit]:
+        with open(lyrics_file, encoding='utf-8', errors='replace') as fp:
+            pages.append(build_page(osp.basename(lyrics_file), fp.read()))
+    return pages
+
+
+def time_parser(parse_func, pages):
+    start = time.perf_counter()
+    results = [parse_func(page) for page in pages]
+    return time.perf_counter() - start, results
+
+
+def run_benchmark(lyrics_dir=LYRICS_DIR, limit=300):
+    # Single process, so pages/sec is per core
+    mismatches = verify_fixtures()
+    pages = build_pages(lyrics_dir, limit)
+    print(f"GENERATED {len(pages)} PAGES, {sum(map(len, pages)) / len(pages) / 1024:.0f}KB AVERAGE")
+
+    bs4_time, bs4_results = time_parser(parse_lyrics_html_bs4, pages)
+    stream_time, stream_results = time_parser(parse_lyrics_html, pages)
+    page_mismatches = sum(1 for bs4_lines, stream_lines in zip(bs4_results, stream_results)
+                          if bs4_lines != stream_lines)
+
+    print(f"BEAUTIFULSOUP: {bs4_time:.3f}s ({len(pages) / bs4_time:.0f} pages/sec per core)")
+    print(f"STREAMING: {stream_time:.3f}s ({len(pages) / stream_time:.0f} pages/sec per core)")
+    print(f"SPEEDUP: {bs4_time / stream_time:.1f}x, MISMATCHES: {page_mismatches}")
+    return {"bs4_sec": bs4_time, "streaming_sec": stream_time, "mismatches": page_mismatches,
+            "fixture_mismatches": mismatches}
+
+
+if __name__ == '__main__':
+    if "--update-fixtures" in sys.argv:
+        update_fixtures()
+    else:
+        benchmark_results = run_benchmark()
+        sys.exit(1 if benchmark_results["mismatches"] or benchmark_results["fixture_mismatches"] else 0)
@@ -0,0 +1,56 @@
+import os
+import os.path as osp
+import time
+from utils.general_utls import is_file_valid
+from utils.lyrics_utils import LyricsHandler, SLANG_WORDS, STOPWORD_LIST, count_lyrics_tokens
+
+LYRICS_DIR = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), "song_lyrics")
+
+
+def legacy_count_lyrics_tokens(lyrics_lines, clean_lyrics):
+    # Word counting as LyricsHandler did it before the single-pass tokenizer, kept as the reference
+    tokenized_lyrics = clean_lyrics.split()
+    cnt_dict = {}
+    for prefix in ["intro", "outro", "verse", "chorus"]:
+        cnt_dict[f"{prefix}_cnt"] = 0
+    for line in lyrics_lines:
+        for prefix in ["intro", "outro", "verse", "chorus"]:
+            if f"[{prefix}" in line:
+                cnt_dict[f"{prefix}_cnt"] += 1
+                break
+
+    def is_slang_word(word):
+        return word.endswith("'") or word.startswith("'") or word.replace("'", "") in SLANG_WORDS
+
+    cnt_dict.update({
+        "word_cnt": len(clean_lyrics.split(" ")),
+        "unique_word_cnt": len(set(clean_lyrics.split(" "))),
+        "stop_word_cnt": sum(1 for word in tokenized_lyrics if word.lower() in STOPWORD_LIST),
+        "slang_word_cnt": sum(1 for word in tokenized_lyrics if is_slang_word(word)),
+    })
+    return cnt_dict
+
+
+def time_counter(count_func, handlers):
+    start = time.perf_counter()
+    results = [count_func(handler.lyrics_lines, handler.clean_lyrics) for handler in handlers]
+    return time.perf_counter() - start, results
+
+
+def run_benchmark(lyrics_dir=LYRICS_DIR):
+    lyrics_files = [osp.join(lyrics_dir, f) for f in sorted(os.listdir(lyrics_dir))]
+    handlers = [LyricsHandler(f) for f in lyrics_files if is_file_valid(f)]
+    print(f"LOADED {len(handlers)} LYRICS FILES")
+
+    legacy_time, legacy_results = time_counter(legacy_count_lyrics_tokens, handlers)
+    new_time, new_results = time_counter(count_lyrics_tokens, handlers)
+    mismatches = sum(1 for legacy, new in zip(legacy_results, new_results) if legacy != new)
+
+    print(f"LEGACY COUNTER: {legacy_time:.3f}s ({len(handlers) / legacy_time:.0f} songs/sec)")
+    print(f"SINGLE PASS COUNTER: {new_time:.3f}s ({len(handlers) / new_time:.0f} songs/sec)")
+    print(f"SPEEDUP: {legacy_time / new_time:.1f}x, MISMATCHES: {mismatches}")
+    return {"legacy_sec": legacy_time, "single_pass_sec": new_time, "mismatches": mismatches}
+
+
+if __name__ == '__main__':
+    run_benchmark()
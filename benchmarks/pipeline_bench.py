@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import os.path as osp
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+from sklearn.tree import DecisionTreeClassifier
+from utils.curation_utils import CleaningPipeline
+from utils.general_utls import get_genre_weights, is_file_valid, label_common_genres, match_word_genres
+from utils.lyrics_utils import LyricsHandler, load_lyrics_resources
+from utils.ml_utils import find_best_k_for_KNN
+from utils.store_utils import load_dataset_store, save_dataset_partition
+
+ROOT_DIR = osp.dirname(osp.dirname(osp.abspath(__file__)))
+LYRICS_DIR = osp.join(ROOT_DIR, "song_lyrics")
+DATASET_PATHS = [osp.join(ROOT_DIR, "dataset.csv"), osp.join(ROOT_DIR, "dataset_test.csv")]
+CURATION_DATASET_PATH = osp.join(ROOT_DIR, "dataset_test.csv")
+RESULTS_DIR = osp.join(ROOT_DIR, "benchmarks", "results")
+
+LABEL_COL = "common_genre"
+NON_FEATURE_COLS = ["source_genre", "name", "artists", "genres", "lyrics_file", "lyrics_url"]
+BIN_COLS = ["release_year", "duration", "line_cnt", "word_cnt", "positive", "negative", "compound"]
+CATEGORICAL_COLS = ["chorus_cnt", "verse_cnt", "intro_cnt", "outro_cnt"]
+INT_COLS = ["release_year", "duration", "popularity", "line_cnt", "word_cnt", *CATEGORICAL_COLS]
+
+
+def scale_dataset(df, factor, seed=0):
+    # Copies of the dataset with distinct song names (so deduplication keeps them) and jittered float features
+    if factor == 1:
+        return df
+    rng = np.random.default_rng(seed)
+    copies = [df]
+    float_cols = df.select_dtypes("float").columns
+    for copy_index in range(1, factor):
+        copy = df.copy()
+        copy["name"] = copy["name"].astype(str) + f" #{copy_index}"
+        copy[float_cols] = copy[float_cols] * rng.normal(1, 0.01, size=(len(copy), len(float_cols)))
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def measure(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def get_max_rss_mb():
+    # Peak resident set size of this process, in KB on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+def measure_peak_memory(stage_name, factor, lyrics_limit):
+    # Runs in a fresh interpreter, the caches warmed by the timing run would hide the allocations of a cold run.
+    # The peak RSS also counts native buffers (pyarrow, numpy, sklearn), tracemalloc only sees python objects.
+    # tracemalloc slows pure python code several times, so time and peak memory come from separate runs.
+    func, _ = get_stages(lyrics_limit)[stage_name](factor)
+    tracemalloc.start()
+    func()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return get_max_rss_mb(), traced_peak / 2 ** 20
+
+
+def measure_in_fresh_process(stage_name, factor, lyrics_limit):
+    with get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(measure_peak_memory, (stage_name, factor, lyrics_limit))
+
+
+def bench_ingestion(factor):
+    frames = [scale_dataset(pd.read_csv(path), factor) for path in DATASET_PATHS]
+
+    def ingest():
+        with tempfile.TemporaryDirectory() as store_dir:
+            [save_dataset_partition(df, store_dir) for df in frames]
+            return len(load_dataset_store(store_dir))
+
+    return ingest, sum(len(df) for df in frames)
+
+
+def bench_featurization(factor, lyrics_limit):
+    lyrics_files = [osp.join(LYRICS_DIR, f) for f in sorted(os.listdir(LYRICS_DIR))]
+    lyrics_files = [f for f in lyrics_files if is_file_valid(f)][:lyrics_limit] * factor
+    # Keep the one time lexicon and stopwords loading out of the measurement
+    load_lyrics_resources()
+
+    def featurize():
+        return [LyricsHandler(f).extract_lyrics_features() for f in lyrics_files]
+
+    return featurize, len(lyrics_files)
+
+
+def bench_genre_labeling(factor):
+    genres = pd.concat([scale_dataset(pd.read_csv(path), factor)["genres"] for path in DATASET_PATHS],
+                       ignore_index=True)
+    # Start from cold caches, like a fresh process
+    get_genre_weights.cache_clear()
+    match_word_genres.cache_clear()
+
+    return lambda: label_common_genres(genres, seed=0), len(genres)
+
+
+def get_cleaning_pipeline():
+    return CleaningPipeline(
+        int_cols=INT_COLS,
+        bin_cols=BIN_COLS,
+        categorical_cols=CATEGORICAL_COLS,
+    )
+
+
+def get_curation_dataset(factor):
+    return scale_dataset(pd.read_csv(CURATION_DATASET_PATH), factor)
+
+
+def bench_curation(factor):
+    # fit_transform drops the missing and duplicated rows itself
+    df = get_curation_dataset(factor)
+    return lambda: get_cleaning_pipeline().fit_transform(df), len(df)
+
+
+def bench_training(factor):
+    df = get_curation_dataset(factor)
+    transformed = get_cleaning_pipeline().fit_transform(df)
+    X = transformed.drop(columns=NON_FEATURE_COLS + [LABEL_COL]).astype("float64")
+    y = transformed[LABEL_COL]
+
+    def train():
+        DecisionTreeClassifier(max_depth=5, min_samples_split=3, random_state=0).fit(X, y)
+        return find_best_k_for_KNN(X, y, n_jobs=1)
+
+    return train, len(X)
+
+
+def get_stages(lyrics_limit):
+    return {
+        "ingestion": bench_ingestion,
+        "featurization": lambda factor: bench_featurization(factor, lyrics_limit),
+        "genre_labeling": bench_genre_labeling,
+        "curation": bench_curation,
+        "training": bench_training,
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scales=(1, 10, 100), stages=None, lyrics_limit=100, trace_memory=True):
+    all_stages = get_stages(lyrics_limit)
+    results = []
+    for factor in scales:
+        for stage_name in stages or all_stages:
+            func, rows_cnt = all_stages[stage_name](factor)
+            seconds = measure(func)
+            peak_mb, traced_mb = measure_in_fresh_process(stage_name, factor, lyrics_limit) if trace_memory else \
+                (None, None)
+            memory = f", PEAK RSS {peak_mb:.1f}MB ({traced_mb:.1f}MB TRACED)" if trace_memory else ""
+            print(f"{stage_name.upper()} x{factor}: {rows_cnt} ROWS IN {seconds:.3f}s{memory}")
+            results.append({
+                "stage": stage_name,
+                "scale": factor,
+                "rows": rows_cnt,
+                "seconds": seconds,
+                "rows_per_sec": rows_cnt / seconds if seconds else None,
+                "peak_mb": peak_mb,
+                "traced_mb": traced_mb,
+            })
+
+    return {
+        "commit": get_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def find_regressions(baseline, current, threshold=0.2):
+    # A stage regressed when its time or peak memory grew by more than threshold over the baseline run
+    baseline_results = {(r["stage"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        base = baseline_results.get((result["stage"], result["scale"]))
+        if base is None:
+            continue
+        for key in ["seconds", "peak_mb"]:
+            if base[key] and result[key] is not None and result[key] > base[key] * (1 + threshold):
+                regressions.append({
+                    "stage": result["stage"],
+                    "scale": result["scale"],
+                    "metric": key,
+                    "baseline": base[key],
+                    "current": result[key],
+                    "change": result[key] / base[key] - 1,
+                })
+
+    return regressions
+
+
+def save_results(results, output_path=None):
+    output_path = output_path or osp.join(RESULTS_DIR, f"{results['commit'] or 'results'}.json")
+    os.makedirs(osp.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as fp:
+        json.dump(results, fp, indent=2)
+    print(f"SAVED RESULTS TO '{output_path}'")
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time and memory benchmark of the dataset pipeline stages")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--stages", nargs="+", choices=list(get_stages(0)))
+    parser.add_argument("--lyrics-limit", type=int, default=100, help="lyrics files featurized at scale 1")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory run of each stage")
+    parser.add_argument("--output", help="results json path, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--baseline", help="results json of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown or memory growth")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.scales, args.stages, args.lyrics_limit, not args.no_memory)
+    save_results(benchmark_results, args.output)
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            found = find_regressions(json.load(fp), benchmark_results, args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression['stage'].upper()} x{regression['scale']} {regression['metric']}: "
+                  f"{regression['baseline']:.3f} -> {regression['current']:.3f} ({regression['change']:+.0%})")
+        if found:
+            sys.exit(1)
+        print("NO REGRESSIONS")
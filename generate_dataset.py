@@ -1,34 +1,76 @@
 import os.path as osp
 
 from utils.patch_utils import recalculate_dataset
-from utils.spotify_utils import fetch_tracks, fetch_track_data
+from utils.checkpoint_utils import CrawlCheckpoint
+from utils.fetch_utils import LyricsFetcher
+from utils.spotify_utils import fetch_tracks, fetch_tracks_data
 from utils.general_utls import GENRE_LIST, save_dataset, load_dataset
+from utils.lyrics_utils import is_lyrics_available
+from utils.metrics_utils import configure_metrics, count, log, print_metrics_summary, save_prometheus
 
 
 def generate_dataset():
+    fetcher = LyricsFetcher(concurrency=fetch_concurrency, rate=fetch_rate)
+    # Every (genre, offset) unit is recorded once saved, so a crashed crawl resumes where it stopped
+    checkpoint = CrawlCheckpoint(checkpoint_file_path, dataset_file_path)
     for offset in range(offset_range):
         limit = min(50, song_per_genre - 50 * (offset + 5))
         for genre in GENRE_LIST:
+            if checkpoint.is_unit_done(genre, offset):
+                log("SKIPPING %s SONGS AT OFFSET %s, ALREADY FETCHED", genre.upper(), offset * 50)
+                continue
             try:
                 dataset = []
-                print(f"\nFETCHING {song_per_genre} {genre.upper()} SONGS, LIMIT: {limit}")
+                ingested_ids = []
+                log("\nFETCHING %s %s SONGS, LIMIT: %s", song_per_genre, genre.upper(), limit)
                 res = fetch_tracks(query + f" genre:{genre}", limit=limit, offset=offset * 50)
                 if not res:
-                    print(f"FAILED TO FETCH {genre.upper()} SONGS")
+                    log("FAILED TO FETCH %s SONGS", genre.upper())
+                    checkpoint.mark_unit_done(genre, offset, [])
                     continue
 
-                for index, track in enumerate(res):
-                    print(f"\nPARSING SONG DATA ({index + 1})")
+                new_tracks = checkpoint.filter_new_tracks(res)
+                log("%s TRACKS ALREADY IN DATASET", len(res) - len(new_tracks))
+                failed_cnt = 0
+                no_lyrics_cnt = 0
+                for index, (track, track_data) in enumerate(zip(new_tracks, fetch_tracks_data(new_tracks, fetcher))):
+                    log("\nPARSING SONG DATA (%s)", index + 1)
+                    if track_data is None:
+                        # Left out of the dataset, the unit stays open so the track is retried on resume
+                        failed_cnt += 1
+                        continue
+                    if not is_lyrics_available(track_data["lyrics_file"]):
+                        # Many songs have no lyrics on genius, they do not keep the unit open
+                        no_lyrics_cnt += 1
+                        continue
                     data = {"source_genre": genre}
-                    track_data = fetch_track_data(track)
                     data.update(track_data)
+                    data["spotify_id"] = track.get("id")
                     dataset.append(data)
-                    print(f"SONG DATA SAVED")
+                    ingested_ids.append(track.get("id"))
+                    count("songs_saved", genre=genre)
+                    log("SONG DATA SAVED")
 
-                save_dataset(dataset, dataset_file_path, False)
+                if dataset:
+                    save_dataset(dataset, dataset_file_path, False)
+                count("no_lyrics_tracks", no_lyrics_cnt)
+                if not failed_cnt:
+                    checkpoint.mark_unit_done(genre, offset, ingested_ids)
+                    continue
+
+                count("failed_tracks", failed_cnt)
+                if checkpoint.mark_unit_failed(genre, offset, ingested_ids):
+                    log("%s %s TRACKS FAILED AT OFFSET %s, GIVING UP THE UNIT", failed_cnt, genre.upper(), offset * 50)
+                else:
+                    log("%s %s TRACKS FAILED AT OFFSET %s, WILL RETRY ON RESUME", failed_cnt, genre.upper(),
+                        offset * 50)
 
             except Exception as e:
-                print(f"FAILED FETCHING TRACKS: {e}")
+                log("FAILED FETCHING TRACKS: %s", e)
+                count("failed_units")
+
+    fetcher.close()
+    checkpoint.finish([(genre, offset) for offset in range(offset_range) for genre in GENRE_LIST])
 
 
 if __name__ == '__main__':
@@ -36,9 +78,23 @@ if __name__ == '__main__':
     file_name = "huge_dataset.csv"
     song_per_genre = 1000
     offset_range = int(song_per_genre / 50) or 1
-    print(f"GOING TO FETCH {song_per_genre * len(GENRE_LIST)} TRACKS")
+    # Parallel lyrics downloads and max requests per second to genius
+    fetch_concurrency = 8
+    fetch_rate = 5.0
+    log("GOING TO FETCH %s TRACKS", song_per_genre * len(GENRE_LIST))
     dataset_file_path = osp.join(osp.dirname(osp.abspath(__file__)), file_name)
+    checkpoint_file_path = f"{dataset_file_path}.checkpoint.json"
+    # Production crawls can turn instrumentation and logs off
+    configure_metrics(enabled=True, verbose=True)
+    metrics_file_path = f"{dataset_file_path}.prom"
     generate_dataset()
+    print_metrics_summary()
+    save_prometheus(metrics_file_path)
+
+    # DAILY INCREMENTAL UPDATE OF A DATASET STORE (see utils.store_utils to migrate a csv file)
+    # from utils.update_utils import update_dataset
+    # update_dataset(store_dir, LyricsFetcher(fetch_concurrency, fetch_rate),
+    #                {genre: query + f" genre:{genre}" for genre in GENRE_LIST})
 
     # RECALCULATE IF NEEDED
     # df = load_dataset(dataset_file_path)
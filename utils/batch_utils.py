@@ -0,0 +1,148 @@
+import os
+import time
+from functools import partial
+from multiprocessing import Pool
+import pandas as pd
+from utils.metrics_utils import log, merge_metrics, take_metrics
+from utils.lyrics_utils import LyricsHandler, get_feature_cache, load_lyrics_resources, get_lyrics_hash, \
+    is_lyrics_available, get_language_cache, detect_language
+
+
+def split_to_chunks(items, chunk_size):
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def get_language_cache_key(lyrics_hash, max_chars=None):
+    return f"{lyrics_hash}:{max_chars or 0}"
+
+
+def extract_features_chunk(lyrics_files, detect_languages=False, max_chars=None):
+    # Runs inside a worker, returns (file, features, language) triples so chunks can be merged in any order.
+    # With detect_languages the language is detected on the clean text of the same handler, the file is read once.
+    results = []
+    for lyrics_file in lyrics_files:
+        handler = LyricsHandler(lyrics_file)
+        language = detect_language(handler.clean_lyrics, max_chars) if detect_languages else None
+        results.append((lyrics_file, handler.extract_lyrics_features(), language))
+    return results
+
+
+def detect_languages_chunk(lyrics_files, max_chars=None):
+    return [(lyrics_file, detect_language(LyricsHandler(lyrics_file).clean_lyrics, max_chars))
+            for lyrics_file in lyrics_files]
+
+
+def run_chunk_with_metrics(func, chunk):
+    # Runs inside a worker, whose timers and counters are not shared with the parent. They are sent back with the
+    # result, what a forked worker inherited from the parent is dropped first.
+    take_metrics()
+    result = func(chunk)
+    return result, take_metrics()
+
+
+def run_chunks(func, chunks, workers=None):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield func(chunk)
+        return
+
+    with Pool(processes=min(workers, len(chunks))) as pool:
+        for result, metrics in pool.imap_unordered(partial(run_chunk_with_metrics, func), chunks):
+            merge_metrics(metrics)
+            yield result
+
+
+def extract_features_batch(lyrics_files, workers=None, chunk_size=64, use_cache=True, detect_languages=False,
+                           max_chars=None):
+    # With detect_languages returns (features_df, {lyrics_file: language}), languages of the extracted files come
+    # from the same pass and only files found in the feature cache are read again for it.
+    # Unique valid files only, invalid ones are skipped like in the serial path
+    lyrics_files = [f for f in dict.fromkeys(lyrics_files) if is_lyrics_available(f)]
+
+    records = {}
+    file_hashes = {}
+    cache = get_feature_cache() if use_cache else None
+    if cache is not None:
+        file_hashes = {lyrics_file: get_lyrics_hash(lyrics_file) for lyrics_file in lyrics_files}
+        cached = cache.get_many(file_hashes.values())
+        records = {f: cached[file_hashes[f]] for f in lyrics_files if file_hashes[f] in cached}
+        log("FOUND %s/%s FILES IN FEATURE CACHE", len(records), len(lyrics_files))
+
+    missing_files = [f for f in lyrics_files if f not in records]
+    chunks = split_to_chunks(missing_files, chunk_size)
+    log("EXTRACTING FEATURES FOR %s FILES IN %s CHUNKS", len(missing_files), len(chunks))
+    if chunks:
+        # Load the lexicon and word lists once here so forked workers share them instead of loading their own
+        load_lyrics_resources()
+
+    languages = {}
+    language_cache = get_language_cache() if use_cache and detect_languages else None
+    extracted_cnt = 0
+    start = time.perf_counter()
+    for result in run_chunks(partial(extract_features_chunk, detect_languages=detect_languages, max_chars=max_chars),
+                             chunks, workers):
+        records.update((lyrics_file, features) for lyrics_file, features, _ in result)
+        if cache is not None:
+            cache.set_many({file_hashes[lyrics_file]: features for lyrics_file, features, _ in result})
+        if detect_languages:
+            languages.update((lyrics_file, language) for lyrics_file, _, language in result)
+        if language_cache is not None:
+            language_cache.set_many("language", {get_language_cache_key(file_hashes[lyrics_file], max_chars): language
+                                                 for lyrics_file, _, language in result})
+        extracted_cnt += len(result)
+        elapsed = time.perf_counter() - start
+        log("EXTRACTED %s/%s FILES (%.1f files/sec)", extracted_cnt, len(missing_files), extracted_cnt / elapsed)
+
+    features_df = pd.DataFrame.from_dict(records, orient="index")
+    # Keep input order regardless of the order chunks were completed in
+    features_df = features_df.reindex([f for f in lyrics_files if f in records])
+    if not detect_languages:
+        return features_df
+
+    cached_files = [f for f in lyrics_files if f not in languages]
+    if cached_files:
+        languages.update(detect_languages_batch(cached_files, workers, chunk_size, max_chars, use_cache))
+    return features_df, languages
+
+
+def merge_features(dataset_df, features_df, key_col="lyrics_file"):
+    # Rows whose file was not extracted keep their current values
+    matched = dataset_df[key_col].isin(features_df.index)
+    aligned = features_df.reindex(dataset_df.loc[matched, key_col])
+    aligned.index = dataset_df.index[matched]
+    for feature in features_df.columns:
+        dataset_df.loc[matched, feature] = aligned[feature]
+
+    return dataset_df
+
+
+def detect_languages_batch(lyrics_files, workers=None, chunk_size=64, max_chars=None, use_cache=True):
+    # Returns {lyrics_file: language}, language is None when it could not be detected or the file is missing
+    lyrics_files = list(dict.fromkeys(lyrics_files))
+    languages = {f: None for f in lyrics_files}
+    valid_files = [f for f in lyrics_files if is_lyrics_available(f)]
+    log("DETECTING LANGUAGE OF %s FILES, %s FILES NOT FOUND", len(valid_files), len(lyrics_files) - len(valid_files))
+
+    cache_keys = {}
+    cache = get_language_cache() if use_cache else None
+    if cache is not None:
+        cache_keys = {f: get_language_cache_key(get_lyrics_hash(f), max_chars) for f in valid_files}
+        cached = cache.get_many("language", cache_keys.values())
+        hits = {f: cached[cache_keys[f]] for f in valid_files if cache_keys[f] in cached}
+        languages.update(hits)
+        valid_files = [f for f in valid_files if f not in hits]
+        log("FOUND %s LANGUAGES IN CACHE", len(hits))
+
+    detected_cnt = 0
+    start = time.perf_counter()
+    for result in run_chunks(partial(detect_languages_chunk, max_chars=max_chars),
+                             split_to_chunks(valid_files, chunk_size), workers):
+        languages.update(result)
+        if cache is not None:
+            cache.set_many("language", {cache_keys[f]: language for f, language in result})
+        detected_cnt += len(result)
+        elapsed = time.perf_counter() - start
+        log("DETECTED %s/%s LANGUAGES (%.1f files/sec)", detected_cnt, len(valid_files), detected_cnt / elapsed)
+
+    return languages
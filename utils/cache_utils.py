@@ -0,0 +1,143 @@
+import json
+import sqlite3
+import time
+from utils.metrics_utils import record_cache
+
+
+class FeatureCache:
+    def __init__(self, db_path, schema_key, max_entries=100000):
+        self.db_path = db_path
+        self.schema_key = schema_key
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS features ("
+                "content_hash TEXT PRIMARY KEY, schema_key TEXT NOT NULL, "
+                "features TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS features_last_access ON features (last_access)")
+            # Entries computed with another feature schema, slang list or stopword list are stale
+            self.conn.execute("DELETE FROM features WHERE schema_key != ?", (schema_key,))
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def get(self, content_hash):
+        return self.get_many([content_hash]).get(content_hash)
+
+    def get_many(self, content_hashes):
+        found = {}
+        content_hashes = list(dict.fromkeys(content_hashes))
+        # Stay below sqlite's bound parameters limit
+        for i in range(0, len(content_hashes), 500):
+            chunk = content_hashes[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT content_hash, features FROM features WHERE content_hash IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            found.update({content_hash: json.loads(features) for content_hash, features in rows})
+        record_cache("features", len(found), len(content_hashes) - len(found))
+
+        if found:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE features SET last_access = ? WHERE content_hash = ?",
+                    [(now, content_hash) for content_hash in found]
+                )
+
+        return found
+
+    def set(self, content_hash, features):
+        self.set_many({content_hash: features})
+
+    def set_many(self, features_map):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO features (content_hash, schema_key, features, last_access) VALUES (?, ?, ?, ?)",
+                [(content_hash, self.schema_key, json.dumps(features), now)
+                 for content_hash, features in features_map.items()]
+            )
+        self.evict()
+
+    def evict(self):
+        # Drop least recently used entries above the size bound
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM features WHERE content_hash IN "
+                    "(SELECT content_hash FROM features ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM features")
+
+    def close(self):
+        self.conn.close()
+
+
+class MetadataCache:
+    # ttl=None keeps entries forever
+    def __init__(self, db_path, ttl=7 * 24 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory = {}
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (kind, key))"
+            )
+            self.conn.execute("DELETE FROM metadata WHERE updated_at < ?", (self.get_min_updated_at(),))
+
+    def get_min_updated_at(self):
+        return time.time() - self.ttl if self.ttl is not None else 0
+
+    def get_many(self, kind, keys):
+        found = {}
+        missing = []
+        keys = list(dict.fromkeys(keys))
+        min_updated_at = self.get_min_updated_at()
+        for key in keys:
+            entry = self.memory.get((kind, key))
+            if entry is not None and entry[1] >= min_updated_at:
+                found[key] = entry[0]
+            else:
+                missing.append(key)
+
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, value, updated_at FROM metadata "
+                f"WHERE kind = ? AND updated_at >= ? AND key IN ({','.join('?' * len(chunk))})",
+                [kind, min_updated_at, *chunk]
+            ).fetchall()
+            for key, value, updated_at in rows:
+                found[key] = json.loads(value)
+                self.memory[(kind, key)] = (found[key], updated_at)
+
+        record_cache(kind, len(found), len(keys) - len(found))
+        return found
+
+    def set_many(self, kind, values_map):
+        now = time.time()
+        self.memory.update({(kind, key): (value, now) for key, value in values_map.items()})
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata (kind, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                [(kind, key, json.dumps(value), now) for key, value in values_map.items()]
+            )
+
+    def clear(self):
+        self.memory.clear()
+        with self.conn:
+            self.conn.execute("DELETE FROM metadata")
+
+    def close(self):
+        self.conn.close()
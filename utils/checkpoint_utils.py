@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+from utils.metrics_utils import log
+
+KNOWN_TRACK_COLUMNS = ["spotify_id", "name", "artists"]
+# The last bytes of the dataset at checkpoint time, they tell whether the file was rewritten since
+FINGERPRINT_SIZE = 65536
+# A unit whose tracks keep failing is given up after this many crawls
+MAX_UNIT_ATTEMPTS = 3
+
+
+def get_known_tracks(dataset_df):
+    known_ids = set(dataset_df["spotify_id"].dropna()) if "spotify_id" in dataset_df else set()
+    known_keys = set(zip(dataset_df["name"], dataset_df["artists"])) if len(dataset_df) else set()
+    return known_ids, known_keys
+
+
+def filter_unknown_tracks(tracks, known_ids, known_keys):
+    # Spotify ids identify tracks added by the updater, older rows are matched by name and first artist
+    return [track for track in tracks if track.get("id") not in known_ids and
+            (str(track.get("name")), str((track.get("artists") or [{}])[0].get("name"))) not in known_keys]
+
+
+def get_dataset_fingerprint(dataset_path, dataset_size):
+    # Hash of the bytes before dataset_size, None when the file is shorter than that
+    if not os.path.exists(dataset_path) or os.path.getsize(dataset_path) < dataset_size:
+        return None
+    with open(dataset_path, 'rb') as fp:
+        fp.seek(max(0, dataset_size - FINGERPRINT_SIZE))
+        return hashlib.sha1(fp.read(min(dataset_size, FINGERPRINT_SIZE))).hexdigest()
+
+
+def read_known_tracks(dataset_path):
+    # Tracks of a csv dataset, rows saved before spotify_id was recorded are known by name and first artist
+    if not os.path.exists(dataset_path) or not os.path.getsize(dataset_path):
+        return set(), set()
+    import pandas as pd
+    dataset_df = pd.read_csv(dataset_path, usecols=lambda col: col in KNOWN_TRACK_COLUMNS)
+    known_ids, known_keys = get_known_tracks(dataset_df)
+    return {str(track_id) for track_id in known_ids}, {(str(name), str(artists)) for name, artists in known_keys}
+
+
+class CrawlCheckpoint:
+    def __init__(self, checkpoint_path, dataset_path):
+        self.checkpoint_path = checkpoint_path
+        self.dataset_path = dataset_path
+        self.completed_units = set()
+        self.track_ids = set()
+        # "genre:offset" -> crawls of the unit that ended with failed tracks
+        self.unit_attempts = {}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r') as fp:
+                state = json.load(fp)
+            self.completed_units = {tuple(unit) for unit in state.get("completed_units", [])}
+            self.track_ids = set(state.get("track_ids", []))
+            self.unit_attempts = state.get("unit_attempts", {})
+            self.dataset_size = state.get("dataset_size", 0)
+            self.dataset_fingerprint = state.get("dataset_fingerprint")
+            log("RESUMING CRAWL: %s UNITS AND %s TRACKS DONE", len(self.completed_units), len(self.track_ids))
+            self.drop_partial_unit()
+        else:
+            # Whatever the dataset already holds was saved by complete units, checkpoint it before crawling
+            self.update_dataset_size()
+            self.save()
+
+        # Rows already in the dataset are skipped even when the checkpoint does not list them
+        known_ids, self.known_keys = read_known_tracks(dataset_path)
+        self.track_ids.update(known_ids)
+
+    def update_dataset_size(self):
+        self.dataset_size = os.path.getsize(self.dataset_path) if os.path.exists(self.dataset_path) else 0
+        self.dataset_fingerprint = get_dataset_fingerprint(self.dataset_path, self.dataset_size)
+
+    def drop_partial_unit(self):
+        # Rows appended after the last checkpoint belong to a unit that did not finish, it is fetched again.
+        # The file is only cut when it still starts with the checkpointed bytes, rows kept otherwise are known
+        # tracks and are not fetched twice anyway.
+        if not os.path.exists(self.dataset_path):
+            return
+        if os.path.getsize(self.dataset_path) <= self.dataset_size:
+            return
+
+        if not self.dataset_size or self.dataset_fingerprint is None or \
+                get_dataset_fingerprint(self.dataset_path, self.dataset_size) != self.dataset_fingerprint:
+            log("'%s' CHANGED SINCE THE LAST CHECKPOINT, KEEPING ITS ROWS", self.dataset_path)
+            self.update_dataset_size()
+            self.save()
+            return
+
+        log("DROPPING PARTIAL UNIT FROM '%s'", self.dataset_path)
+        with open(self.dataset_path, 'r+b') as fp:
+            fp.truncate(self.dataset_size)
+
+    def is_unit_done(self, genre, offset):
+        return (genre, offset) in self.completed_units
+
+    def filter_new_tracks(self, tracks):
+        return filter_unknown_tracks(tracks, self.track_ids, self.known_keys)
+
+    def record_tracks(self, track_ids):
+        # Tracks saved by a unit that had failures, the unit is fetched again but they are not
+        self.track_ids.update(track_ids)
+        self.update_dataset_size()
+        self.save()
+
+    def mark_unit_done(self, genre, offset, track_ids):
+        self.completed_units.add((genre, offset))
+        self.unit_attempts.pop(f"{genre}:{offset}", None)
+        self.record_tracks(track_ids)
+
+    def mark_unit_failed(self, genre, offset, track_ids):
+        # Returns True when the unit is given up, after MAX_UNIT_ATTEMPTS crawls with failed tracks
+        key = f"{genre}:{offset}"
+        self.unit_attempts[key] = self.unit_attempts.get(key, 0) + 1
+        if self.unit_attempts[key] >= MAX_UNIT_ATTEMPTS:
+            self.mark_unit_done(genre, offset, track_ids)
+            return True
+        self.record_tracks(track_ids)
+        return False
+
+    def finish(self, units):
+        # Once every unit is done the checkpoint is removed, a later crawl starts from the dataset as it is then
+        if not all(unit in self.completed_units for unit in units):
+            return False
+        os.remove(self.checkpoint_path)
+        log("CRAWL DONE, REMOVED '%s'", self.checkpoint_path)
+        return True
+
+    def save(self):
+        state = {
+            "completed_units": sorted(self.completed_units),
+            "track_ids": sorted(self.track_ids),
+            "unit_attempts": self.unit_attempts,
+            "dataset_size": self.dataset_size,
+            "dataset_fingerprint": self.dataset_fingerprint,
+        }
+        # Write aside and rename so a crash never leaves a half written checkpoint
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as fp:
+            json.dump(state, fp)
+        os.replace(tmp_path, self.checkpoint_path)
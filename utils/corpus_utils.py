@@ -0,0 +1,110 @@
+import json
+import mmap
+import os
+import os.path as osp
+import struct
+import sys
+import zlib
+from utils.metrics_utils import log
+
+# Layout: MAGIC | blobs | json index {key: [offset, length, compressed, size, mtime_ns]} |
+# FOOTER(index offset, index length). size and mtime_ns are the packed file's, they tell whether the loose file
+# changed since it was packed
+MAGIC = b"GRLYRC01"
+FOOTER = struct.Struct("<QQ")
+
+
+def get_corpus_key(lyrics_file):
+    # Songs are looked up by file name so 'song_lyrics/x.txt' and '/abs/path/song_lyrics/x.txt' match
+    return osp.basename(lyrics_file)
+
+
+def pack_corpus(lyrics_dir, archive_path, compress=True):
+    index = {}
+    with open(archive_path, 'wb') as archive:
+        archive.write(MAGIC)
+        for file_name in sorted(os.listdir(lyrics_dir)):
+            file_path = osp.join(lyrics_dir, file_name)
+            if not osp.isfile(file_path):
+                continue
+            stat = os.stat(file_path)
+            with open(file_path, 'rb') as fp:
+                data = fp.read()
+            if not data:
+                # Empty files are not valid lyrics, keep them out like is_file_valid does
+                continue
+
+            blob = zlib.compress(data, 9) if compress else data
+            # Only keep the compressed version when it is actually smaller
+            compressed = compress and len(blob) < len(data)
+            if not compressed:
+                blob = data
+            index[get_corpus_key(file_name)] = [archive.tell(), len(blob), compressed, stat.st_size, stat.st_mtime_ns]
+            archive.write(blob)
+
+        index_offset = archive.tell()
+        index_bytes = json.dumps(index).encode()
+        archive.write(index_bytes)
+        archive.write(FOOTER.pack(index_offset, len(index_bytes)))
+
+    log("PACKED %s LYRICS FILES INTO '%s' (%s BYTES)", len(index), archive_path, os.path.getsize(archive_path))
+    return len(index)
+
+
+class LyricsArchive:
+    # Lyrics rewritten by save_lyrics are invalidated, reading them never costs a syscall per file.
+    # check_loose_files=True also picks up files edited by other means, with a stat per lookup.
+    def __init__(self, archive_path, check_loose_files=False):
+        self.archive_path = archive_path
+        self.check_loose_files = check_loose_files
+        with open(archive_path, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"'{archive_path}' is not a lyrics archive")
+
+        index_offset, index_length = FOOTER.unpack(self.mm[-FOOTER.size:])
+        self.index = json.loads(self.mm[index_offset:index_offset + index_length])
+
+    def get_entry(self, lyrics_file):
+        entry = self.index.get(get_corpus_key(lyrics_file))
+        if entry is None or not self.check_loose_files:
+            return entry
+
+        # The archived copy is only used while the loose file, if there is one, is still the file that was packed.
+        # An edited file wins, archives without the packed size and mtime always defer to it.
+        try:
+            stat = os.stat(lyrics_file)
+        except OSError:
+            return entry
+        if entry[3:] != [stat.st_size, stat.st_mtime_ns]:
+            return None
+        return entry
+
+    def invalidate(self, lyrics_file):
+        # Called before a lyrics file is rewritten, its archived copy is stale from now on
+        self.index.pop(get_corpus_key(lyrics_file), None)
+
+    def __contains__(self, lyrics_file):
+        return self.get_entry(lyrics_file) is not None
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_bytes(self, lyrics_file):
+        entry = self.get_entry(lyrics_file)
+        if entry is None:
+            return None
+
+        offset, length, compressed = entry[:3]
+        blob = self.mm[offset:offset + length]
+        return zlib.decompress(blob) if compressed else blob
+
+    def close(self):
+        self.mm.close()
+
+
+if __name__ == '__main__':
+    root_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+    src_dir = sys.argv[1] if len(sys.argv) > 1 else osp.join(root_dir, "song_lyrics")
+    dst_path = sys.argv[2] if len(sys.argv) > 2 else osp.join(root_dir, "song_lyrics.pack")
+    pack_corpus(src_dir, dst_path)
@@ -31,7 +31,11 @@ def my_iqr(col):
 
 def outlier_detection_iqr(df, dfunc):
     df_main = df.copy()
-    [dfunc(df_main[col]) for col in df_main.select_dtypes('number')]
+    for col in df_main.select_dtypes('number'):
+        # With copy-on-write a column taken from the frame is not a view, mutate it apart and put it back
+        values = df_main[col].astype("float64")
+        dfunc(values)
+        df_main[col] = values
 
     return df_main
 
@@ -52,3 +56,127 @@ def transfer_to_categorical(df, bin_cols, categorical_col_names):
     )
 
     return transferred_df
+
+
+class CleaningPipeline:
+    # Fused version of the notebook's curation steps: outliers -> median repair -> int casting -> ratios ->
+    # binning -> one-hot. fit() learns every statistic once from the training data, transform() reuses them on
+    # new data working column-wise on one numpy block, with a single copy of the frame.
+    def __init__(self, outlier_method="z_score", numeric_cols=None, int_cols=(), ratio_cols=None,
+                 bin_cols=(), categorical_cols=(), bins_cnt=5):
+        self.outlier_method = outlier_method
+        self.numeric_cols = numeric_cols
+        self.int_cols = list(int_cols)
+        # {ratio_col: (numerator_col, denominator_col)}
+        self.ratio_cols = ratio_cols or {}
+        self.bin_cols = list(bin_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.bins_cnt = bins_cnt
+        self.outlier_stats = None
+        self.medians = None
+        self.bin_edges = {}
+        self.categories = {}
+
+    @staticmethod
+    def drop_rows(df):
+        # Same rows as remove_duplicates_and_drop_na, duplicates are looked for after dropping missing values
+        keep = df.notna().all(axis=1).to_numpy(copy=True)
+        keep[keep] = ~df[keep].duplicated(["name", "artists"]).to_numpy()
+        return df[keep]
+
+    def get_outlier_mask(self, values, col_index=None):
+        # values holds all numeric columns, or only the column at col_index
+        stats = [stat if col_index is None else stat[col_index] for stat in self.outlier_stats]
+        if self.outlier_method == "z_score":
+            mean, std = stats
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.abs((values - mean) / std) > 3
+        lower, upper = stats
+        return (values < lower) | (values > upper)
+
+    def fit_outlier_stats(self, df):
+        cols = df[self.numeric_cols]
+        if self.outlier_method == "z_score":
+            return cols.mean().to_numpy(), cols.std().to_numpy()
+        if self.outlier_method == "iqr":
+            q1 = cols.quantile(0.25).to_numpy()
+            q3 = cols.quantile(0.75).to_numpy()
+            iqr = q3 - q1
+            return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+        raise ValueError(f"Unknown outlier method: {self.outlier_method}")
+
+    def fit(self, df):
+        # Statistics are learned on the rows the notebook keeps, without missing values and duplicates
+        return self.fit_kept_rows(self.drop_rows(df))
+
+    def fit_kept_rows(self, df):
+        if self.numeric_cols is None:
+            self.numeric_cols = df.select_dtypes('number').columns.to_list()
+
+        self.outlier_stats = self.fit_outlier_stats(df)
+        values = df[self.numeric_cols].to_numpy(dtype="float64", copy=True)
+        values[self.get_outlier_mask(values)] = np.nan
+        self.medians = np.nanmedian(values, axis=0)
+
+        # Bins and categories are learned on repaired data, like the notebook does
+        repaired = self.repair(values)
+        repaired_cols = dict(zip(self.numeric_cols, repaired.T))
+        for col in self.bin_cols:
+            col_values = self.get_repaired_col(df, repaired_cols, col)
+            _, self.bin_edges[col] = pd.cut(col_values, self.bins_cnt, retbins=True)
+        for col in self.categorical_cols:
+            self.categories[col] = np.unique(self.get_repaired_col(df, repaired_cols, col))
+
+        return self
+
+    def get_repaired_col(self, df, repaired_cols, col):
+        if col in self.ratio_cols:
+            numerator, denominator = self.ratio_cols[col]
+            return self.get_repaired_col(df, repaired_cols, numerator) / \
+                self.get_repaired_col(df, repaired_cols, denominator)
+        values = repaired_cols.get(col, df[col].to_numpy())
+        return values.astype("int64") if col in self.int_cols else values
+
+    def repair(self, values):
+        missing = np.isnan(values)
+        if missing.any():
+            values[missing] = np.take(self.medians, np.nonzero(missing)[1])
+        return values
+
+    def transform(self, df):
+        values = df[self.numeric_cols].to_numpy(dtype="float64", copy=True)
+        values[self.get_outlier_mask(values)] = np.nan
+        values = self.repair(values)
+
+        # Every output column is collected first and the frame is built once, the only copy of the data
+        repaired_cols = dict(zip(self.numeric_cols, values.T))
+        columns = {}
+        for col in df.columns:
+            if col in self.categorical_cols:
+                continue
+            if col not in repaired_cols:
+                columns[col] = df[col]
+            else:
+                columns[col] = repaired_cols[col].astype("int64") if col in self.int_cols else repaired_cols[col]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for col, (numerator, denominator) in self.ratio_cols.items():
+                columns[col] = np.asarray(columns[numerator]) / np.asarray(columns[denominator])
+
+        labels = list(range(1, self.bins_cnt + 1))
+        for col in self.bin_cols:
+            # Intervals are closed on the right like pd.cut, values out of the training range become NaN
+            codes = np.searchsorted(self.bin_edges[col], np.asarray(columns[col]), side="left") - 1
+            codes[(codes < 0) | (codes >= self.bins_cnt)] = -1
+            columns[f"{col}_categorical"] = pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+
+        for col in self.categorical_cols:
+            col_values = self.get_repaired_col(df, repaired_cols, col)
+            for category in self.categories[col]:
+                columns[f"{col}_{category}"] = col_values == category
+
+        return pd.DataFrame(columns, index=df.index)
+
+    def fit_transform(self, df):
+        # Training rows are the kept rows, fit and transform both work on them
+        df = self.drop_rows(df)
+        return self.fit_kept_rows(df).transform(df)
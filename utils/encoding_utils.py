@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+# Code -1 is kept for categories never seen in fit and for missing values
+UNKNOWN_CODE = -1
+CODE_DTYPES = ["int8", "int16", "int32", "int64"]
+
+
+def get_code_dtype(categories_cnt):
+    # Smallest signed integer type holding codes -1 .. categories_cnt - 1
+    for dtype in CODE_DTYPES:
+        if categories_cnt - 1 <= np.iinfo(dtype).max:
+            return dtype
+    return CODE_DTYPES[-1]
+
+
+class CategoricalEncoder:
+    # Integer codes learned once from the training data: the position of the value in the column's sorted
+    # categories, like transfer_str_to_numeric_vals numbers them. By default every non numeric column is
+    # encoded, which covers object columns, the transfer_to_categorical bins and the one-hot bool columns.
+    def __init__(self, columns=None):
+        self.columns = None if columns is None else list(columns)
+        self.categories = {}
+        self.dtypes = {}
+
+    def fit(self, df):
+        columns = self.columns
+        if columns is None:
+            columns = df.select_dtypes(exclude="number").columns.to_list()
+        self.columns = columns
+        for column in columns:
+            self.categories[column] = df[column].astype("category").cat.categories
+            self.dtypes[column] = get_code_dtype(len(self.categories[column]))
+        return self
+
+    def encode_column(self, column, values):
+        # Vectorized hash lookup of the values in the fitted categories, unseen and missing values get -1
+        codes = pd.Categorical(values, categories=self.categories[column]).codes
+        return codes.astype(self.dtypes[column], copy=False)
+
+    def transform(self, df):
+        columns = [column for column in self.columns if column in df.columns]
+        encoded = {column: self.encode_column(column, df[column]) for column in columns}
+        return df.assign(**encoded)
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    def save(self, encoder_path):
+        import joblib
+        joblib.dump(self, encoder_path)
+
+
+def load_categorical_encoder(encoder_path):
+    import joblib
+    return joblib.load(encoder_path)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+SUMMARY_METRICS = ["accuracy", "precision", "recall", "f1"]
+# Bootstrap resamples are drawn in batches of about this many indices, to bound memory on large test sets
+BOOTSTRAP_BATCH_SIZE = 2000000
+
+
+def get_labels(*label_arrays):
+    # Sorted union of the labels, the order sklearn.metrics uses
+    return np.unique(np.concatenate([np.asarray(labels) for labels in label_arrays]))
+
+
+def encode_pairs(y_true, y_pred, labels):
+    # (true, predicted) label pairs as a single cell index of the flattened confusion matrix
+    true_codes = np.searchsorted(labels, np.asarray(y_true))
+    pred_codes = np.searchsorted(labels, np.asarray(y_pred))
+    return true_codes * len(labels) + pred_codes
+
+
+def count_pairs(pairs, labels_cnt):
+    # Rows are true labels, columns predicted ones, like sklearn.metrics.confusion_matrix
+    return np.bincount(pairs, minlength=labels_cnt ** 2).reshape(labels_cnt, labels_cnt)
+
+
+def build_confusion_matrix(y_true, y_pred, labels=None):
+    labels = get_labels(y_true, y_pred) if labels is None else np.asarray(labels)
+    return count_pairs(encode_pairs(y_true, y_pred, labels), len(labels))
+
+
+def safe_divide(numerator, denominator):
+    # Classes never predicted or never present score 0, sklearn's zero_division default
+    return np.divide(numerator, denominator, out=np.zeros(np.shape(numerator)), where=denominator > 0)
+
+
+def get_confusion_metrics(confusion_matrix):
+    # All metrics from the confusion matrix alone. Works on a stack of matrices too, shape (..., labels, labels).
+    confusion_matrix = np.asarray(confusion_matrix)
+    true_positives = np.diagonal(confusion_matrix, axis1=-2, axis2=-1)
+    support = confusion_matrix.sum(axis=-1)
+    predicted = confusion_matrix.sum(axis=-2)
+    total = support.sum(axis=-1)
+
+    per_class = {
+        "precision": safe_divide(true_positives, predicted),
+        "recall": safe_divide(true_positives, support),
+        "f1": safe_divide(2 * true_positives, support + predicted),
+    }
+    metrics = {"accuracy": safe_divide(true_positives.sum(axis=-1), total)}
+    for metric, values in per_class.items():
+        metrics[metric] = safe_divide((values * support).sum(axis=-1), total)
+        metrics[f"macro_{metric}"] = values.mean(axis=-1)
+    return metrics, per_class, support
+
+
+def bootstrap_metrics(pairs_list, labels_cnt, n_bootstrap=1000, random_state=0):
+    # Every prediction array is scored on the same resamples of the test rows, so intervals of different models
+    # are comparable. One bincount per resample batch builds all the resampled confusion matrices at once.
+    rows_cnt = len(pairs_list[0])
+    cells_cnt = labels_cnt ** 2
+    rng = np.random.default_rng(random_state)
+    batch_size = max(1, BOOTSTRAP_BATCH_SIZE // rows_cnt)
+    results = [{metric: [] for metric in SUMMARY_METRICS} for _ in pairs_list]
+    for batch_start in range(0, n_bootstrap, batch_size):
+        resamples_cnt = min(batch_size, n_bootstrap - batch_start)
+        sample_idx = rng.integers(0, rows_cnt, size=(resamples_cnt, rows_cnt))
+        offsets = np.arange(resamples_cnt)[:, None] * cells_cnt
+        for pairs, result in zip(pairs_list, results):
+            cells = np.bincount((pairs[sample_idx] + offsets).ravel(), minlength=resamples_cnt * cells_cnt)
+            metrics, _, _ = get_confusion_metrics(cells.reshape(resamples_cnt, labels_cnt, labels_cnt))
+            [result[metric].append(metrics[metric]) for metric in SUMMARY_METRICS]
+
+    return [{metric: np.concatenate(values) for metric, values in result.items()} for result in results]
+
+
+def get_confidence_interval(values, ci=0.95):
+    # Percentile interval of the bootstrap distribution
+    low, high = np.quantile(values, [(1 - ci) / 2, (1 + ci) / 2])
+    return float(low), float(high)
+
+
+def evaluate_predictions(y_true, y_pred, labels=None, n_bootstrap=0, ci=0.95, random_state=0):
+    # Accuracy, weighted and macro precision/recall/f1, per class metrics and the confusion matrix from a single
+    # pass over the labels. With n_bootstrap > 0 the summary metrics get confidence intervals.
+    labels = get_labels(y_true, y_pred) if labels is None else np.asarray(labels)
+    pairs = encode_pairs(y_true, y_pred, labels)
+    confusion_matrix = count_pairs(pairs, len(labels))
+    metrics, per_class, support = get_confusion_metrics(confusion_matrix)
+
+    report = {metric: float(value) for metric, value in metrics.items()}
+    report["confusion_matrix"] = confusion_matrix
+    report["per_class"] = pd.DataFrame({**per_class, "support": support}, index=labels)
+    if n_bootstrap:
+        samples = bootstrap_metrics([pairs], len(labels), n_bootstrap, random_state)[0]
+        report["ci"] = {metric: get_confidence_interval(values, ci) for metric, values in samples.items()}
+    return report
+
+
+def compare_predictions(predictions, y_true, n_bootstrap=1000, ci=0.95, sort_by="f1", random_state=0):
+    # predictions: {model name: predicted labels on the same held out rows}. One row per model with the summary
+    # metrics and, with n_bootstrap > 0, their confidence intervals over shared resamples.
+    labels = get_labels(y_true, *predictions.values())
+    pairs_list = [encode_pairs(y_true, y_pred, labels) for y_pred in predictions.values()]
+    samples_list = bootstrap_metrics(pairs_list, len(labels), n_bootstrap, random_state) if n_bootstrap else None
+
+    rows = []
+    for index, (name, pairs) in enumerate(zip(predictions, pairs_list)):
+        metrics, _, _ = get_confusion_metrics(count_pairs(pairs, len(labels)))
+        row = {"model": name, **{metric: float(metrics[metric]) for metric in SUMMARY_METRICS}}
+        if samples_list:
+            for metric, values in samples_list[index].items():
+                row[f"{metric}_low"], row[f"{metric}_high"] = get_confidence_interval(values, ci)
+        rows.append(row)
+
+    # Stable sort, ties keep the models' order
+    return pd.DataFrame(rows).sort_values(sort_by, ascending=False, kind="stable", ignore_index=True)
+
+
+def compare_models(models, X_test, y_test, n_bootstrap=1000, ci=0.95, sort_by="f1", random_state=0):
+    # models: {name: fitted classifier}, all scored on the same held out data
+    predictions = {name: model.predict(X_test) for name, model in models.items()}
+    return compare_predictions(predictions, y_test, n_bootstrap, ci, sort_by, random_state)
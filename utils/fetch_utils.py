@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from utils.lyrics_utils import FETCH_TIMEOUT, parse_lyrics_html, save_lyrics
+from utils.metrics_utils import count, log, timed
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a token is available, tokens refill continuously at `rate` per second
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class LyricsFetcher:
+    def __init__(self, concurrency=8, rate=5.0, burst=None, retries=3, backoff=1.0, timeout=FETCH_TIMEOUT):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        # One pooled connection per worker thread
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt
+
+    def get(self, url):
+        response = None
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                with timed("fetch"):
+                    response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as err:
+                log("FAILED FETCHING %s: %s", url, err)
+                count("http_errors")
+                response = None
+            else:
+                count("http_requests", status=response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+
+            if attempt < self.retries:
+                count("http_retries")
+                time.sleep(self.get_retry_delay(attempt, response))
+
+        return response
+
+    def fetch(self, url):
+        log("Fetching: %s", url)
+        response = self.get(url)
+        if response is None or response.status_code != 200:
+            log("Lyrics data not found")
+            return None
+
+        return parse_lyrics_html(response.content)
+
+    def fetch_and_save(self, url, lyrics_file, separator="\n"):
+        lyrics = self.fetch(url)
+        if not lyrics:
+            return False
+
+        save_lyrics(separator.join(lyrics), lyrics_file)
+        return True
+
+    def fetch_and_save_many(self, url_file_pairs, separator="\n"):
+        # Returns {lyrics_file: saved} for every requested pair, a pair that raised is a failure like in fetch_and_save
+        url_file_pairs = list(url_file_pairs)
+        if not url_file_pairs:
+            return {}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.fetch_and_save, url, lyrics_file, separator): (url, lyrics_file)
+                       for url, lyrics_file in url_file_pairs}
+            # Input order, whatever order the pages complete in
+            saved = {lyrics_file: False for _, lyrics_file in url_file_pairs}
+            for future in as_completed(futures):
+                url, lyrics_file = futures[future]
+                try:
+                    saved[lyrics_file] = future.result()
+                except Exception as err:
+                    log("FAILED SAVING %s TO '%s': %s", url, lyrics_file, err)
+                    count("fetch_errors")
+
+        elapsed = time.perf_counter() - start
+        log("FETCHED %s/%s LYRICS PAGES (%.1f pages/sec)", sum(saved.values()), len(saved), len(saved) / elapsed)
+        return saved
+
+    def close(self):
+        self.session.close()
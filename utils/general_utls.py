@@ -1,24 +1,31 @@
+import ast
 import random
 import re
 from collections import Counter
+from functools import lru_cache
 import os
 import pandas as pd
+from utils.metrics_utils import log, timed_function
 
 GENRE_LIST = [
     'pop', 'rock', 'hip-hop', 'rap', 'r&b', 'soul', 'electronic', 'dance', 'country', 'jazz', 'classical',
     'reggae', 'alternative', 'indie', 'folk', 'metal', 'punk', 'blues', 'world', 'funk', 'disco', 'gospel'
 ]
 
+GENRE_MAPPING = {
+    'canadian hip hop': 'hip-hop',
+    'lgbtq+ hip hop': 'hip-hop',
+    'hip hop': 'hip-hop',
+    'hip pop': 'hip-hop',
+    "metalcore": "metal",
+    "k-pop": "pop",
+}
+# Zero width lookahead so overlapping genres inside one word are all found
+GENRE_PATTERN = re.compile("(?=(" + "|".join(re.escape(genre) for genre in GENRE_LIST) + "))")
+
 
 def fix_genre(genre_string):
-    mapping = {
-        'canadian hip hop': 'hip-hop',
-        'lgbtq+ hip hop': 'hip-hop',
-        'hip hop': 'hip-hop',
-        'hip pop': 'hip-hop',
-        "metalcore": "metal",
-        "k-pop": "pop",
-    }
+    mapping = GENRE_MAPPING
     # Return genre mapped genre if matched
     if genre_string.lower() in mapping.keys():
         return mapping.get(genre_string)
@@ -40,21 +47,48 @@ def remove_non_genres(word_list):
     return [genre for genre in GENRE_LIST for item in word_list if genre in item and item != 'trap']
 
 
-def get_common_genre(song_genres):
+@lru_cache(maxsize=None)
+def match_word_genres(word):
+    # Same as remove_non_genres for a single word, in GENRE_LIST order
+    if word == 'trap':
+        return ()
+    found = set(GENRE_PATTERN.findall(word))
+    return tuple(genre for genre in GENRE_LIST if genre in found)
+
+
+@lru_cache(maxsize=None)
+def get_genre_weights(song_genres):
+    # song_genres is a tuple, returns the known genres and their counts or None if there are none
     dash_removed = [item.replace("-", " ") for item in song_genres]
     split_list = [item.partition("hip hop") for item in dash_removed]
     flatten = [subitem for item in split_list for subitem in item if subitem]
     fixed_list = [fix_genre(item) for item in flatten]
-    new_list = split_list_items(fixed_list)
-    clean_list = remove_non_genres(new_list)
-    if not clean_list:
+    genre_counts = Counter(genre for word in split_list_items(fixed_list) for genre in match_word_genres(word))
+    if not genre_counts:
+        return None
+
+    elements = tuple(genre for genre in GENRE_LIST if genre in genre_counts)
+    freqs = tuple(genre_counts[genre] for genre in elements)
+    return elements, freqs
+
+
+def get_common_genre(song_genres, rng=None):
+    genre_weights = get_genre_weights(tuple(song_genres))
+    if genre_weights is None:
         return
 
-    genre_counts = Counter(clean_list)  # dict
-    elements = [element for element, freq in genre_counts.items()]
-    freqs = [freq for element, freq in genre_counts.items()]
+    elements, freqs = genre_weights
     # Choose randomly between the known genres!
-    return random.choices(elements,freqs)[0]
+    return (rng or random).choices(elements, freqs)[0]
+
+
+def label_common_genres(genres_column, seed=None):
+    # Labels a whole genres column, stringified lists (as read from csv) are parsed first.
+    # With a seed the labels are reproducible, same as calling get_common_genre per row after random.seed(seed)
+    rng = random.Random(seed)
+    genre_lists = [ast.literal_eval(genres) if isinstance(genres, str) else genres for genres in genres_column]
+    labels = [get_common_genre(genres, rng) for genres in genre_lists]
+    return pd.Series(labels, index=getattr(genres_column, "index", None), dtype=object)
 
 
 def purify_text(text):
@@ -76,29 +110,57 @@ def purify_text(text):
 def remove_file(file_path):
     try:
         os.remove(file_path)
-        print("File removed successfully")
+        log("File removed successfully")
     except OSError as e:
         pass
 
 
+def is_dataset_store(filepath):
+    # A partitioned parquet store is a directory, see utils.store_utils. A path that does not exist yet is a new
+    # store unless it has a file extension, e.g. 'dataset.csv' or 'dataset.csv.gz'.
+    if os.path.isdir(filepath):
+        return True
+    if os.path.exists(filepath):
+        return False
+    return not os.path.splitext(filepath)[1]
+
+
+@timed_function("save_dataset")
 def save_dataset(data, filepath, overwrite=False):
     # Convert raw data into pandas df for an easier save
     if not isinstance(data, pd.DataFrame):
         data = pd.DataFrame(data)
 
-    if overwrite or not os.path.exists(filepath):
+    if is_dataset_store(filepath):
+        from utils.store_utils import save_dataset_partition, get_partition_files
+        if overwrite:
+            [os.remove(f) for f in get_partition_files(filepath)]
+        # Appends are written as a new partition
+        save_dataset_partition(data, filepath)
+
+    elif overwrite or not os.path.exists(filepath):
         # write mode by default, overwrites csv data
         data.to_csv(filepath, index=False)
 
     else:
-        # Append to an existing csv file, ignore header
-        data.to_csv(filepath, index=False, mode="a", header=False)
+        # Append to an existing csv file in the order of its header, columns it does not have are left out
+        header = pd.read_csv(filepath, nrows=0).columns
+        dropped_cols = [col for col in data.columns if col not in header]
+        if dropped_cols:
+            log("COLUMNS %s ARE NOT IN '%s', NOT SAVED", dropped_cols, filepath)
+        data.reindex(columns=header).to_csv(filepath, index=False, mode="a", header=False)
+
+    log("Data successfully saved as '%s'.", filepath)
 
-    print(f"Data successfully saved as '{filepath}'.")
 
+def load_dataset(filepath, columns=None, filters=None):
+    if is_dataset_store(filepath):
+        from utils.store_utils import load_dataset_store
+        return load_dataset_store(filepath, columns, filters)
 
-def load_dataset(filepath):
-    return pd.read_csv(filepath)
+    if filters:
+        raise ValueError("Filters are only supported by dataset stores, migrate the csv with utils.store_utils")
+    return pd.read_csv(filepath, usecols=columns)
 
 
 def is_file_valid(file_path):
@@ -0,0 +1,199 @@
+import re
+from html.parser import HTMLParser
+
+LYRICS_CONTAINER_ATTR = "data-lyrics-container"
+# Tag and attribute names are case insensitive. The search starts at the '-', a case insensitive pattern starting
+# with a letter is an order of magnitude slower to search.
+LYRICS_CONTAINER_PATTERN = re.compile(re.escape(LYRICS_CONTAINER_ATTR[4:]), re.IGNORECASE)
+NEWLINES_PATTERN = re.compile('\n{2,}')
+# Text of these tags is not part of the lyrics, BeautifulSoup's get_text skips it too
+SKIPPED_TAGS = {"script", "style", "template", "rt", "rp"}
+# Like BeautifulSoup, text made of these only is collapsed to a newline or a space outside of <pre> and <textarea>
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+# Small chunks, the parser tokenizes the rest of a chunk after the container is closed
+FEED_CHUNK_SIZE = 4096
+# Markers inside these are not tags, e.g. the lyrics selector in Genius' preloaded state script
+RAW_BLOCK_ENDS = {"<script": re.compile("</script", re.IGNORECASE), "<style": re.compile("</style", re.IGNORECASE),
+                  "<!--": re.compile("-->")}
+RAW_BLOCK_PATTERN = re.compile("<script|<style|<!--", re.IGNORECASE)
+
+
+def is_lyrics_container(tag, attrs):
+    # Attribute names come lower cased from HTMLParser, the value is matched case insensitively like the bs4 path
+    return tag == "div" and any(name == LYRICS_CONTAINER_ATTR and value is not None and value.lower() == "true"
+                                for name, value in attrs)
+
+
+class LyricsContainerParser(HTMLParser):
+    # Collects the text of a single lyrics container, fed from its opening tag. Stops caring about the input
+    # as soon as the container div is closed, so the rest of the page is never tokenized.
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.pending = []
+        self.started = False
+        self.done = False
+        self.is_container = False
+        self.div_depth = 0
+        self.skipped_depth = 0
+        self.preserve_depth = 0
+        # (line, column) positions relative to the first fed character: the container's closing tag and the
+        # opening tags of lyrics containers nested in it
+        self.end_pos = None
+        self.nested_starts = []
+
+    def flush_data(self):
+        # Text between two tags is one string, whatever the feed chunks were
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        if not self.preserve_depth and not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        self.parts.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        self.flush_data()
+        if not self.started:
+            self.started = True
+            self.is_container = is_lyrics_container(tag, attrs)
+            self.done = not self.is_container
+            self.div_depth = 1
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag == "div":
+            self.div_depth += 1
+            if is_lyrics_container(tag, attrs):
+                self.nested_starts.append(self.getpos())
+        elif tag in SKIPPED_TAGS:
+            self.skipped_depth += 1
+        elif tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>, other self closing tags have no text
+        if self.done:
+            return
+        self.flush_data()
+        if not self.started:
+            # <div data-lyrics-container="true"/> is an empty container for BeautifulSoup
+            self.started = self.done = True
+            self.is_container = is_lyrics_container(tag, attrs)
+            self.end_pos = self.getpos()
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag == "div" and is_lyrics_container(tag, attrs):
+            self.nested_starts.append(self.getpos())
+
+    def handle_endtag(self, tag):
+        if self.done or not self.started:
+            return
+        self.flush_data()
+        if tag == "div":
+            self.div_depth -= 1
+            self.done = self.div_depth == 0
+            if self.done:
+                self.end_pos = self.getpos()
+        elif tag in SKIPPED_TAGS:
+            self.skipped_depth = max(0, self.skipped_depth - 1)
+        elif tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth = max(0, self.preserve_depth - 1)
+
+    def handle_comment(self, data):
+        if self.started and not self.done:
+            self.flush_data()
+
+    def handle_data(self, data):
+        if self.started and not self.done and not self.skipped_depth:
+            self.pending.append(data)
+
+    def get_text(self):
+        self.flush_data()
+        return "".join(self.parts)
+
+
+def decode_html(html_content):
+    if isinstance(html_content, str):
+        return html_content
+    try:
+        return html_content.decode("utf-8")
+    except UnicodeDecodeError:
+        return html_content.decode("windows-1252", errors="replace")
+
+
+def get_text_offset(html_text, start, line, column):
+    # HTMLParser positions count lines from 1 and columns from 0, from where feeding started
+    pos = start
+    for _ in range(line - 1):
+        pos = html_text.index("\n", pos) + 1
+    return pos + column
+
+
+def read_container(html_text, tag_start):
+    parser = LyricsContainerParser()
+    offset = tag_start
+    while not parser.done and offset < len(html_text):
+        parser.feed(html_text[offset:offset + FEED_CHUNK_SIZE])
+        offset += FEED_CHUNK_SIZE
+    if not parser.done:
+        # Container left open until the end of the page
+        parser.close()
+    return parser
+
+
+def parse_container(html_text, tag_start, lyrics_lines):
+    # Appends the text of the container starting at tag_start, then of the containers nested in it at any depth,
+    # in document order like BeautifulSoup's find_all. Returns the offset of its closing tag, the page is scanned
+    # on from there, or None when the tag is not a lyrics container.
+    parser = read_container(html_text, tag_start)
+    if not parser.is_container:
+        return None
+
+    lyrics_lines.append(NEWLINES_PATTERN.sub('\n', parser.get_text().strip()))
+    for line, column in parser.nested_starts:
+        nested = read_container(html_text, get_text_offset(html_text, tag_start, line, column))
+        lyrics_lines.append(NEWLINES_PATTERN.sub('\n', nested.get_text().strip()))
+    return len(html_text) if parser.end_pos is None else get_text_offset(html_text, tag_start, *parser.end_pos)
+
+
+def find_container_attr(html_text, start=0):
+    # Position of the next data-lyrics-container in any case, -1 if there is none
+    for match in LYRICS_CONTAINER_PATTERN.finditer(html_text, start + 4):
+        pos = match.start() - 4
+        if html_text[pos:match.start()].lower() == LYRICS_CONTAINER_ATTR[:4]:
+            return pos
+    return -1
+
+
+def extract_lyrics_containers(html_content):
+    # Same output as the BeautifulSoup path: the text of every data-lyrics-container div with <br> as newlines,
+    # stripped and with repeated newlines collapsed. Jumps between containers and over scripts with regex
+    # searches, the page is scanned once.
+    html_text = decode_html(html_content)
+    lyrics_lines = []
+    pos = find_container_attr(html_text)
+    cursor = 0
+    while pos != -1:
+        raw_block = RAW_BLOCK_PATTERN.search(html_text, cursor, pos)
+        if raw_block:
+            block_end = RAW_BLOCK_ENDS[raw_block.group().lower()].search(html_text, raw_block.end())
+            if block_end is None:
+                break
+            cursor = block_end.start()
+            if cursor > pos:
+                pos = find_container_attr(html_text, cursor)
+            continue
+        cursor = pos
+        tag_start = html_text.rfind("<", 0, pos)
+        end = parse_container(html_text, tag_start, lyrics_lines) if tag_start != -1 else None
+        if end is not None:
+            # The container and the ones nested in it are done, markers in their text are not containers
+            cursor = max(end, pos + len(LYRICS_CONTAINER_ATTR))
+            pos = find_container_attr(html_text, cursor)
+        else:
+            pos = find_container_attr(html_text, pos + len(LYRICS_CONTAINER_ATTR))
+
+    return lyrics_lines
@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import joblib
+import pandas as pd
+from utils.encoding_utils import CategoricalEncoder
+from utils.lyrics_utils import LyricsHandler, load_lyrics_resources
+
+_loaded_models = {}
+
+
+class GenreModel:
+    # Everything needed to go from raw track metadata and lyrics to a genre: the fitted cleaning pipeline,
+    # the categorical encoder, the training feature columns and the estimator
+    def __init__(self, pipeline, encoder, feature_columns, estimator):
+        self.pipeline = pipeline
+        self.encoder = encoder
+        self.feature_columns = feature_columns
+        self.estimator = estimator
+
+    def encode(self, df):
+        # Categories never seen in training get -1
+        return self.encoder.transform(df)
+
+    def build_features(self, records):
+        # records: dicts of spotify metadata (the dataset columns) plus the raw lyrics text under "lyrics"
+        rows = []
+        for record in records:
+            row = {key: value for key, value in record.items() if key != "lyrics"}
+            row.update(LyricsHandler.from_text(record.get("lyrics") or "").extract_lyrics_features())
+            rows.append(row)
+
+        transformed = self.encode(self.pipeline.transform(pd.DataFrame(rows)))
+        # Dummy columns of categories missing from this batch are all False, encoded as 0
+        return transformed.reindex(columns=self.feature_columns, fill_value=0)
+
+    def predict(self, records):
+        if not records:
+            return []
+        return self.estimator.predict(self.build_features(records)).tolist()
+
+    def predict_one(self, lyrics, metadata):
+        return self.predict([{**metadata, "lyrics": lyrics}])[0]
+
+    def save(self, model_path):
+        joblib.dump(self, model_path)
+
+
+def train_genre_model(dataset, pipeline, estimator, label_col, drop_cols=()):
+    transformed = pipeline.fit_transform(dataset)
+    features = transformed.drop(columns=[label_col, *drop_cols])
+    model = GenreModel(pipeline, CategoricalEncoder().fit(features), None, estimator)
+    features = model.encode(features)
+    model.feature_columns = features.columns.to_list()
+    estimator.fit(features, transformed[label_col])
+    return model
+
+
+def load_genre_model(model_path, warm_up=True):
+    # Loaded models are kept per path, so only the first call pays for unpickling
+    model = _loaded_models.get(model_path)
+    if model is None:
+        model = joblib.load(model_path)
+        _loaded_models[model_path] = model
+        if warm_up:
+            # Loads the VADER lexicon and stopwords now instead of on the first request
+            load_lyrics_resources()
+            LyricsHandler.from_text("warm up").extract_lyrics_features()
+    return model
+
+
+class MicroBatcher:
+    # Collects concurrent predict requests and runs them as one batch, when max_batch_size requests are
+    # waiting or the oldest one waited max_wait_ms
+    def __init__(self, model, max_batch_size=64, max_wait_ms=5):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.stopped = threading.Event()
+        # Makes the closed check and the put of submit atomic with close, no request is queued after the flush
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, lyrics, metadata):
+        future = Future()
+        with self.lock:
+            if self.stopped.is_set():
+                raise RuntimeError("MicroBatcher is closed")
+            self.requests.put(({**metadata, "lyrics": lyrics}, future))
+        return future
+
+    def predict(self, lyrics, metadata, timeout=None):
+        return self.submit(lyrics, metadata).result(timeout)
+
+    def collect_batch(self):
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def predict_batch(self, batch):
+        records, futures = zip(*batch)
+        try:
+            predictions = self.model.predict(list(records))
+        except Exception as err:
+            [future.set_exception(err) for future in futures]
+            return
+        [future.set_result(prediction) for future, prediction in zip(futures, predictions)]
+
+    def run(self):
+        while not self.stopped.is_set():
+            batch = self.collect_batch()
+            if batch:
+                self.predict_batch(batch)
+
+    def close(self):
+        # Requests submitted before close are still predicted, later submits raise
+        with self.lock:
+            self.stopped.set()
+        self.worker.join()
+        batch = []
+        while not self.requests.empty():
+            batch.append(self.requests.get_nowait())
+            if len(batch) == self.max_batch_size:
+                self.predict_batch(batch)
+                batch = []
+        if batch:
+            self.predict_batch(batch)
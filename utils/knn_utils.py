@@ -0,0 +1,69 @@
+import joblib
+from joblib import Parallel, delayed
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+from sklearn.neighbors import KDTree
+
+
+class KNNIndex:
+    # KD tree over the standardized feature matrix. Queried once at the largest k, the neighbors of every smaller
+    # k are a prefix of the result, so all candidate k values are scored from a single query.
+    def __init__(self, X, y, leaf_size=40, scale=True):
+        X = np.asarray(X, dtype="float64")
+        self.mean = X.mean(axis=0) if scale else np.zeros(X.shape[1])
+        std = X.std(axis=0) if scale else np.ones(X.shape[1])
+        # Constant columns carry no distance information, leave them unscaled
+        self.std = np.where(std > 0, std, 1)
+        self.classes, self.labels = np.unique(np.asarray(y), return_inverse=True)
+        self.tree = KDTree(self.scale(X), leaf_size=leaf_size)
+
+    def scale(self, X):
+        return (np.asarray(X, dtype="float64") - self.mean) / self.std
+
+    def kneighbors(self, X, k):
+        # Rows sorted by distance, the same neighbors KNeighborsClassifier finds
+        return self.tree.query(self.scale(X), k=k, sort_results=True)
+
+    def predict(self, X, k=5):
+        return self.predict_all_k(X, [k])[k]
+
+    def predict_all_k(self, X, ks):
+        # Uniform majority vote like KNeighborsClassifier, ties go to the first class in sorted order
+        ks = sorted(set(ks))
+        _, neighbors = self.kneighbors(X, min(ks[-1], len(self.labels)))
+        neighbor_labels = self.labels[neighbors]
+        votes = np.zeros((len(neighbor_labels), len(self.classes)), dtype="int32")
+        rows = np.arange(len(neighbor_labels))
+        predictions = {}
+        for index in range(neighbor_labels.shape[1]):
+            votes[rows, neighbor_labels[:, index]] += 1
+            if index + 1 in ks:
+                predictions[index + 1] = self.classes[votes.argmax(axis=1)]
+        for k in ks:
+            # k larger than the training set votes with all of it
+            predictions.setdefault(k, self.classes[votes.argmax(axis=1)])
+        return predictions
+
+    def save(self, index_path):
+        joblib.dump(self, index_path)
+
+
+def load_knn_index(index_path, mmap_mode="r"):
+    # The tree arrays are memory mapped, so a large index is not read into memory up front
+    return joblib.load(index_path, mmap_mode=mmap_mode)
+
+
+def score_fold(X, y, train, test, ks, scale, leaf_size):
+    index = KNNIndex(X[train], y[train], leaf_size, scale)
+    return {k: np.mean(predicted == y[test]) for k, predicted in index.predict_all_k(X[test], ks).items()}
+
+
+def score_k_values(X, y, ks, cv=5, scale=True, leaf_size=40, n_jobs=None):
+    # Mean cross validation accuracy per k, with one tree and one neighbor query per fold
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(y)
+    fold_scores = Parallel(n_jobs=n_jobs)(
+        delayed(score_fold)(X, y, train, test, ks, scale, leaf_size)
+        for train, test in StratifiedKFold(n_splits=cv).split(X, y)
+    )
+    return {k: np.mean([scores[k] for scores in fold_scores]) for k in ks}
@@ -1,96 +1,195 @@
+import hashlib
+import io
 import json
 import os
 import os.path as osp
 import re
-import requests
-from bs4 import BeautifulSoup
-from nltk.sentiment import SentimentIntensityAnalyzer
-from nltk.corpus import stopwords
+from collections import Counter
+from functools import cached_property, partial
+from utils.cache_utils import FeatureCache, MetadataCache
+from utils.corpus_utils import LyricsArchive
 from utils.general_utls import is_file_valid
-from langdetect import detect
+from utils.html_utils import extract_lyrics_containers
+from utils.metrics_utils import count, log, timed, timed_function
 
 slang_file_path = osp.join(osp.dirname(osp.abspath(__file__)), 'slang_words.txt')
 
-STOPWORD_LIST = set(stopwords.words('english'))
-SLANG_WORDS = []
-with open(slang_file_path, 'r') as file:
-    [SLANG_WORDS.append(line.strip()) for line in file]
+SECTION_PREFIXES = ["intro", "outro", "verse", "chorus"]
+SECTION_PATTERN = re.compile(r"\[(intro|outro|verse|chorus)")
+DASH_PATTERN = re.compile(r'-')
+BRACKETS_PATTERN = re.compile(r'\[.*?\]')
+NON_LETTERS_PATTERN = re.compile(r'[^a-zA-Z\s\']')
+
+# Bump whenever extract_lyrics_features output changes, cached features of older versions are dropped
+FEATURE_SCHEMA_VERSION = 1
+FEATURE_CACHE_PATH = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), 'feature_cache.sqlite')
+_feature_cache = None
+_language_cache = None
+_sentiment_analyzer = None
+_lyrics_archive = None
+# nltk, bs4 and langdetect take seconds to import, they and the word lists are loaded on first use
+_stopwords = None
+_slang_words = None
+_slang_word_set = None
+
+# Seconds to wait for a lyrics page before giving up
+FETCH_TIMEOUT = 10
+
+
+def get_stopwords():
+    global _stopwords
+    if _stopwords is None:
+        from nltk.corpus import stopwords
+        _stopwords = set(stopwords.words('english'))
+    return _stopwords
+
+
+def get_slang_words():
+    global _slang_words, _slang_word_set
+    if _slang_words is None:
+        with open(slang_file_path, 'r') as file:
+            _slang_words = [line.strip() for line in file]
+        _slang_word_set = frozenset(_slang_words)
+    return _slang_words
+
+
+def get_slang_word_set():
+    if _slang_word_set is None:
+        get_slang_words()
+    return _slang_word_set
+
+
+def load_lyrics_resources():
+    # Loads everything feature extraction needs, call it before forking workers so they share it
+    get_stopwords()
+    get_slang_words()
+    get_sentiment_analyzer()
+
+
+# The word lists used to be module constants, they are still available under their old names
+LAZY_ATTRIBUTES = {
+    "STOPWORD_LIST": get_stopwords,
+    "SLANG_WORDS": get_slang_words,
+    "SLANG_WORD_SET": get_slang_word_set,
+}
+
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        return LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def open_lyrics_archive(archive_path, check_loose_files=False):
+    # Lyrics found in the archive (see utils.corpus_utils) are read from it, the rest from loose files.
+    # Files saved with save_lyrics replace their archived copy, check_loose_files also catches other edits.
+    global _lyrics_archive
+    _lyrics_archive = LyricsArchive(archive_path, check_loose_files) if archive_path else None
+    return _lyrics_archive
+
+
+def read_lyrics_bytes(lyrics_file):
+    data = _lyrics_archive.get_bytes(lyrics_file) if _lyrics_archive is not None else None
+    if data is not None:
+        return data
+    with open(lyrics_file, 'rb') as fp:
+        return fp.read()
+
+
+def is_lyrics_available(lyrics_file):
+    return (_lyrics_archive is not None and lyrics_file in _lyrics_archive) or is_file_valid(lyrics_file)
+
+
+def get_lyrics_hash(lyrics_file):
+    return hashlib.sha1(read_lyrics_bytes(lyrics_file)).hexdigest()
 
 
 class LyricsHandler:
     def __init__(self, lyrics_file):
-        if not is_file_valid(lyrics_file):
+        if not is_lyrics_available(lyrics_file):
             raise FileNotFoundError
 
-        self.lyrics_raw = self.load_song_lyrics(lyrics_file)
+        self.set_lyrics(self.load_song_lyrics(lyrics_file))
+
+    @classmethod
+    def from_text(cls, lyrics_text):
+        # For lyrics that are not saved in a file, e.g. when predicting
+        handler = cls.__new__(cls)
+        # Universal newlines, like the text mode read of load_song_lyrics
+        handler.set_lyrics(lyrics_text.replace("\r\n", "\n").replace("\r", "\n").lower())
+        return handler
+
+    def set_lyrics(self, lyrics_raw):
+        self.lyrics_raw = lyrics_raw
         self.lyrics_lines = [line for line in self.lyrics_raw.split("\n") if line]
         self.clean_lyrics = self.clean_lyrics_string(" ".join(self.lyrics_lines))
-        self.tokenized_lyrics = self.clean_lyrics.split()
 
     @staticmethod
     def load_song_lyrics(text_file):
-        with open(text_file, 'r') as tf:
+        # Decoded like a file opened in text mode (locale encoding, universal newlines)
+        with io.TextIOWrapper(io.BytesIO(read_lyrics_bytes(text_file))) as tf:
             string = tf.read()
         return string.lower()
 
     @staticmethod
     def clean_lyrics_string(string):
-        string = re.sub(r'-', ' ', string)
+        string = DASH_PATTERN.sub(' ', string)
         # Allow only letters, but remove anything inside a [] before to get rid of vers/chorus/singer names
-        return re.sub(r'[^a-zA-Z\s\']', '', re.sub(r'\[.*?\]', '', string))
+        return NON_LETTERS_PATTERN.sub('', BRACKETS_PATTERN.sub('', string))
 
     @staticmethod
-    def is_slang_word(word):
-        return word.endswith("'") or word.startswith("'") or word.replace("'", "") in SLANG_WORDS
+    def is_slang_word(word, slang_words=None):
+        # Callers checking many words pass the set in, instead of going through the lazy getter for each one
+        slang_words = get_slang_word_set() if slang_words is None else slang_words
+        return word.endswith("'") or word.startswith("'") or word.replace("'", "") in slang_words
 
     @staticmethod
-    def is_stop_word(word):
-        return word.lower() in STOPWORD_LIST
+    def is_stop_word(word, stop_words=None):
+        stop_words = get_stopwords() if stop_words is None else stop_words
+        return word.lower() in stop_words
 
-    def intro_outro_vers_chorus_cnt(self):
-        section_prefixes = ["intro", "outro", "verse", "chorus"]
-        cnt_dict = {f"{prefix}_cnt": 0 for prefix in section_prefixes}
-        for line in self.lyrics_lines:
-            for prefix in section_prefixes:
-                if f"[{prefix}" in line:
-                    cnt_dict[f"{prefix}_cnt"] += 1
-                    break
+    @cached_property
+    def tokenized_lyrics(self):
+        return self.clean_lyrics.split()
 
-        return cnt_dict
+    @cached_property
+    def token_counts(self):
+        return count_lyrics_tokens(self.lyrics_lines, self.clean_lyrics)
+
+    def intro_outro_vers_chorus_cnt(self):
+        return {f"{prefix}_cnt": self.token_counts[f"{prefix}_cnt"] for prefix in SECTION_PREFIXES}
 
     def count_words_by_type(self, word_type, unique=False):
         if word_type == "slang":
-            return self.count_special_words(self.is_slang_word, unique)
+            return self.token_counts["slang_word_cnt"] if not unique else \
+                self.count_special_words(partial(self.is_slang_word, slang_words=get_slang_word_set()), unique)
         if word_type == "stop":
-            return self.count_special_words(self.is_stop_word, unique)
+            return self.token_counts["stop_word_cnt"] if not unique else \
+                self.count_special_words(partial(self.is_stop_word, stop_words=get_stopwords()), unique)
         if word_type == "all":
-            return len(self.clean_lyrics.split(" ")) if not unique else len(set(self.clean_lyrics.split(" ")))
+            return self.token_counts["word_cnt"] if not unique else self.token_counts["unique_word_cnt"]
 
     def count_special_words(self, detect_func, unique):
         word_list = self.tokenized_lyrics if not unique else set(self.tokenized_lyrics)
-        # return [word for word in word_list if detect_func(word)]
         return sum(1 for word in word_list if detect_func(word))
 
     def sentiment_analysis(self):
-        sid = SentimentIntensityAnalyzer()
-        sentiment = sid.polarity_scores(self.clean_lyrics)
+        with timed("sentiment"):
+            sentiment = get_sentiment_analyzer().polarity_scores(self.clean_lyrics)
         return sentiment
 
+    @timed_function("featurize")
     def extract_lyrics_features(self):
-        word_count = self.count_words_by_type("all")
-        unique_words = self.count_words_by_type("all", unique=True)
-        stopword_count = self.count_words_by_type("stop")
-        slang_word_count = self.count_words_by_type("slang")
-        cnt_dict = self.intro_outro_vers_chorus_cnt()
+        counts = self.token_counts
         sentiment = self.sentiment_analysis()
 
         features = {
-            **cnt_dict,
+            **self.intro_outro_vers_chorus_cnt(),
             "line_cnt": len(self.lyrics_lines),
-            "word_cnt": word_count,
-            "unique_word_cnt": unique_words,
-            "stop_word_cnt": stopword_count,
-            "slang_word_cnt": slang_word_count,
+            "word_cnt": counts["word_cnt"],
+            "unique_word_cnt": counts["unique_word_cnt"],
+            "stop_word_cnt": counts["stop_word_cnt"],
+            "slang_word_cnt": counts["slang_word_cnt"],
             "positive": sentiment.get("pos"),
             "negative": sentiment.get("neg"),
             "neutral": sentiment.get("neu"),
@@ -99,35 +198,135 @@ class LyricsHandler:
         return features
 
 
-def fetch_lyrics(url):
+def count_lyrics_tokens(lyrics_lines, clean_lyrics):
+    counts = {f"{prefix}_cnt": 0 for prefix in SECTION_PREFIXES}
+    for line in lyrics_lines:
+        if "[" not in line:
+            continue
+        # A line is counted once, for the first prefix in SECTION_PREFIXES order that it contains
+        found = SECTION_PATTERN.findall(line)
+        if found:
+            counts[f"{min(found, key=SECTION_PREFIXES.index)}_cnt"] += 1
+
+    # Words are split on single spaces (empty strings included) for the total and unique counts,
+    # stop and slang words on any whitespace. Each distinct piece is classified once and weighted by its frequency.
+    piece_counts = Counter(clean_lyrics.split(" "))
+    stop_words = get_stopwords()
+    slang_words = get_slang_word_set()
+    stop_word_cnt = 0
+    slang_word_cnt = 0
+    for piece, freq in piece_counts.items():
+        for word in piece.split():
+            if LyricsHandler.is_stop_word(word, stop_words):
+                stop_word_cnt += freq
+            if LyricsHandler.is_slang_word(word, slang_words):
+                slang_word_cnt += freq
+
+    counts.update({
+        "word_cnt": sum(piece_counts.values()),
+        "unique_word_cnt": len(piece_counts),
+        "stop_word_cnt": stop_word_cnt,
+        "slang_word_cnt": slang_word_cnt,
+    })
+    return counts
+
+
+def get_sentiment_analyzer():
+    # Loading the VADER lexicon is expensive, so one analyzer is shared by the whole process
+    # (and inherited by forked workers if it was created before the pool)
+    global _sentiment_analyzer
+    if _sentiment_analyzer is None:
+        from nltk.sentiment import SentimentIntensityAnalyzer
+        _sentiment_analyzer = SentimentIntensityAnalyzer()
+    return _sentiment_analyzer
+
+
+def batch_sentiment_analysis(clean_lyrics_list):
+    sid = get_sentiment_analyzer()
+    return [sid.polarity_scores(clean_lyrics) for clean_lyrics in clean_lyrics_list]
+
+
+def get_feature_schema_key():
+    # Changing the slang file or the stopword list invalidates the cached features
+    word_lists = "\n".join(get_slang_words()) + "\0" + "\n".join(sorted(get_stopwords()))
+    return f"{FEATURE_SCHEMA_VERSION}-{hashlib.sha1(word_lists.encode()).hexdigest()}"
+
+
+def get_feature_cache():
+    global _feature_cache
+    if _feature_cache is None:
+        _feature_cache = FeatureCache(FEATURE_CACHE_PATH, get_feature_schema_key())
+    return _feature_cache
+
+
+def get_language_cache():
+    # Detected languages never expire, they only depend on the lyrics content
+    global _language_cache
+    if _language_cache is None:
+        _language_cache = MetadataCache(FEATURE_CACHE_PATH, ttl=None)
+    return _language_cache
+
+
+def extract_lyrics_features_cached(lyrics_file, cache=None):
+    # FeatureCache has a length, an empty cache passed in is falsy
+    if cache is None:
+        cache = get_feature_cache()
+    content_hash = get_lyrics_hash(lyrics_file)
+    features = cache.get(content_hash)
+    if features is None:
+        log("INIT HANDLER FOR FILE: %s", lyrics_file)
+        features = LyricsHandler(lyrics_file).extract_lyrics_features()
+        cache.set(content_hash, features)
+
+    return features
+
+
+@timed_function("parse")
+def parse_lyrics_html(html_content):
+    # Single pass extraction of the lyrics containers, same output as parse_lyrics_html_bs4
+    return extract_lyrics_containers(html_content)
+
+
+def parse_lyrics_html_bs4(html_content):
+    from bs4 import BeautifulSoup
+    # Use BeautifulSoup to parse the HTML content
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Find the lyrics section
+    lyrics_divs = soup.find_all('div', attrs={"data-lyrics-container": re.compile("^true$", re.IGNORECASE)})
+    lyrics_lines = []
+    for d in lyrics_divs:
+        [lb.replaceWith('\n') for lb in d.findAll('br')]
+
+        lines = re.sub('\n{2,}', '\n', d.getText().strip())
+        lyrics_lines.append(lines)
+
+    return lyrics_lines
+
+
+def fetch_lyrics(url, session=None, timeout=FETCH_TIMEOUT):
     # Format the artist and song title for the URL
-    print(f"Fetching: {url}")
-    # Send a GET request to the URL
-    response = requests.get(url)
+    log("Fetching: %s", url)
+    import requests
+    # Send a GET request to the URL, reusing the caller's connection pool if given
+    with timed("fetch"):
+        response = (session or requests).get(url, timeout=timeout)
+    count("http_requests", status=response.status_code)
 
     # Check if the request was successful
     if response.status_code == 200:
-        print("I got something")
-        # Use BeautifulSoup to parse the HTML content
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Find the lyrics section
-        lyrics_divs = soup.find_all('div', attrs={"data-lyrics-container": "true"})
-        lyrics_lines = []
-        for d in lyrics_divs:
-            [lb.replaceWith('\n') for lb in d.findAll('br')]
-
-            lines = re.sub('\n{2,}', '\n', d.getText().strip())
-            lyrics_lines.append(lines)
+        log("I got something")
+        return parse_lyrics_html(response.content)
 
-        return lyrics_lines
-
-    print(f"Lyrics data not found")
+    log("Lyrics data not found")
     # Return None if lyrics couldn't be fetched
     return None
 
 
+@timed_function("save")
 def save_lyrics(txt, file_path):
+    if _lyrics_archive is not None:
+        _lyrics_archive.invalidate(file_path)
     with open(file_path, 'w') as file:
         file.write(txt)
 
@@ -135,15 +334,12 @@ def save_lyrics(txt, file_path):
 def get_lyrics_and_save(genius_url, lyrics_file):
     lyrics = fetch_lyrics(genius_url)
     if not lyrics:
-        print("RETURNS PARTIAL DATA DUE TO LYRICS FETCH FAILURE")
+        log("RETURNS PARTIAL DATA DUE TO LYRICS FETCH FAILURE")
         return
 
     save_lyrics('\n'.join(lyrics), lyrics_file)
 
-    print(f"INIT HANDLER FOR FILE: {lyrics_file}")
-    lyrics_handler = LyricsHandler(lyrics_file)
-    lyrics_features = lyrics_handler.extract_lyrics_features()
-    return lyrics_features
+    return extract_lyrics_features_cached(lyrics_file)
 
 
 def reget_lyrics_df(dataset):
@@ -156,16 +352,25 @@ def reget_lyrics_df(dataset):
     return dataset
 
 
-def is_english_song(row):
-    handler = LyricsHandler(row["lyrics_file"])
-    lyrics = handler.clean_lyrics
+def detect_language(clean_lyrics, max_chars=None):
+    from langdetect import detect, DetectorFactory
+    # langdetect is random by default, seed it so the same lyrics always get the same answer
+    DetectorFactory.seed = 0
     try:
-        language = detect(lyrics)
+        return detect(clean_lyrics[:max_chars] if max_chars else clean_lyrics)
     except:
-        return False
+        return None
 
-    return language == "en"
+
+def is_english_song(row, max_chars=None):
+    handler = LyricsHandler(row["lyrics_file"])
+    return detect_language(handler.clean_lyrics, max_chars) == "en"
 
 
-def remove_non_english_songs(df):
-    return df[df.apply(is_english_song, axis=1)]
+def remove_non_english_songs(df, workers=None, chunk_size=64, max_chars=None, languages=None):
+    # languages: {lyrics_file: language} from extract_features_batch(..., detect_languages=True), saves reading
+    # and cleaning the lyrics again
+    if languages is None:
+        from utils.batch_utils import detect_languages_batch
+        languages = detect_languages_batch(df["lyrics_file"].tolist(), workers, chunk_size, max_chars)
+    return df[df["lyrics_file"].map(languages).eq("en")]
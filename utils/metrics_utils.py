@@ -0,0 +1,195 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# With instrumentation disabled timers, counters and log() return right away, for production crawls
+_enabled = True
+_verbose = True
+_lock = threading.Lock()
+# stage -> [calls, total seconds, max seconds]
+_timers = defaultdict(lambda: [0, 0.0, 0.0])
+# (name, sorted label items) -> value
+_counters = defaultdict(int)
+_NOOP_TIMER = nullcontext()
+
+
+def configure_metrics(enabled=True, verbose=True):
+    global _enabled, _verbose
+    _enabled = enabled
+    _verbose = verbose
+
+
+def reset_metrics():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def take_metrics():
+    # Timers and counters recorded since the last call, which are reset. Pool workers send them to the parent
+    with _lock:
+        snapshot = {stage: list(timer) for stage, timer in _timers.items()}, dict(_counters)
+        _timers.clear()
+        _counters.clear()
+    return snapshot
+
+
+def merge_metrics(snapshot):
+    timers, counters = snapshot
+    with _lock:
+        for stage, (calls, total, max_sec) in timers.items():
+            timer = _timers[stage]
+            timer[0] += calls
+            timer[1] += total
+            timer[2] = max(timer[2], max_sec)
+        for key, value in counters.items():
+            _counters[key] += value
+
+
+def log(message, *args):
+    # log("FETCHED %s PAGES", pages_cnt), the message is only formatted when logs are on
+    if _verbose:
+        print(message % args if args else message)
+
+
+def record_time(stage, seconds):
+    with _lock:
+        timer = _timers[stage]
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds)
+
+
+class StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_time(self.stage, time.perf_counter() - self.start)
+
+
+def timed(stage):
+    # with timed("parse"): ...
+    return StageTimer(stage) if _enabled else _NOOP_TIMER
+
+
+def timed_function(stage):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with StageTimer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **labels):
+    if not _enabled or not value:
+        return
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += value
+
+
+def record_cache(cache_name, hits, misses):
+    count("cache_hits", hits, cache=cache_name)
+    count("cache_misses", misses, cache=cache_name)
+
+
+def get_metrics_summary():
+    with _lock:
+        timers = {stage: list(timer) for stage, timer in _timers.items()}
+        counters = dict(_counters)
+
+    stages = {
+        stage: {"calls": calls, "total_sec": total, "mean_ms": total / calls * 1000, "max_ms": max_sec * 1000}
+        for stage, (calls, total, max_sec) in sorted(timers.items())
+    }
+    cache_hit_rates = {}
+    for name, labels in counters:
+        if name in ("cache_hits", "cache_misses"):
+            hits = counters.get(("cache_hits", labels), 0)
+            cache_hit_rates[dict(labels)["cache"]] = hits / (hits + counters.get(("cache_misses", labels), 0))
+    return {
+        "stages": stages,
+        "counters": {format_metric_name(name, labels): value for (name, labels), value in sorted(counters.items())},
+        "cache_hit_rates": cache_hit_rates,
+    }
+
+
+def format_metric_name(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def print_metrics_summary():
+    summary = get_metrics_summary()
+    print("STAGE TIMES:")
+    for stage, stats in summary["stages"].items():
+        print(f"  {stage}: {stats['calls']} CALLS, {stats['total_sec']:.3f}s TOTAL, "
+              f"{stats['mean_ms']:.2f}ms MEAN, {stats['max_ms']:.2f}ms MAX")
+    print("COUNTERS:")
+    for name, value in summary["counters"].items():
+        print(f"  {name}: {value}")
+    print("CACHE HIT RATES:")
+    for cache_name, hit_rate in summary["cache_hit_rates"].items():
+        print(f"  {cache_name}: {hit_rate:.1%}")
+
+
+def to_prometheus(prefix="genreco"):
+    # Prometheus text exposition format, ready for a node exporter textfile collector
+    with _lock:
+        timers = sorted((stage, list(timer)) for stage, timer in _timers.items())
+        counters = sorted(_counters.items())
+
+    lines = []
+    if timers:
+        lines.append(f"# TYPE {prefix}_stage_calls_total counter")
+        lines.extend(f'{prefix}_stage_calls_total{{stage="{stage}"}} {calls}' for stage, (calls, _, _) in timers)
+        lines.append(f"# TYPE {prefix}_stage_seconds_total counter")
+        lines.extend(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {total}' for stage, (_, total, _) in timers)
+        lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+        lines.extend(f'{prefix}_stage_seconds_max{{stage="{stage}"}} {max_sec}' for stage, (_, _, max_sec) in timers)
+
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            typed.add(name)
+        lines.append(f"{format_metric_name(f'{prefix}_{name}_total', labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def save_prometheus(file_path, prefix="genreco"):
+    with open(file_path, 'w') as fp:
+        fp.write(to_prometheus(prefix))
+
+
+@contextmanager
+def profile_run(output_path=None, top=30, sort_by="cumulative"):
+    # cProfile capture of everything run inside the block, the stats file opens with snakeviz or pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_path:
+            profiler.dump_stats(output_path)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats(sort_by).print_stats(top)
+        print(stream.getvalue())
@@ -1,18 +1,26 @@
-from sklearn.metrics import make_scorer
-from sklearn.model_selection import train_test_split
-from sklearn import metrics
-from sklearn.model_selection import cross_val_score
-from sklearn.model_selection import GridSearchCV
-from sklearn import neighbors, tree, ensemble, naive_bayes, svm
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn import tree
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.naive_bayes import GaussianNB
-from sklearn.svm import SVC
+import itertools
+import os.path as osp
+import time
+import numpy as np
+import pandas as pd
+from utils.evaluation_utils import build_confusion_matrix, compare_models, get_confusion_metrics
+from utils.metrics_utils import log
+
+# scikit-learn and joblib are imported by the functions using them, importing sklearn takes seconds
+
+MODEL_CACHE_DIR = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), ".model_cache")
+
+MODEL_PARAM_GRIDS = {
+    "KNN": {"n_neighbors": [1, 2, 3, 4, 5, 7, 9, 11, 13, 15, 17, 19]},
+    "naive_bayes": {},
+    "svm": {"C": [0.1, 1, 10], "gamma": ["scale"]},
+    "decision_tree": {"max_depth": [3, 5, 10, None], "min_samples_split": [2, 3, 5]},
+    "random_forest": {"n_estimators": [100, 300], "max_depth": [None, 10]},
+}
 
 
 def split_to_train_and_test(dataset, label_column, test_ratio, rand_state):
+    from sklearn.model_selection import train_test_split
     X_train, X_test, y_train, y_test = train_test_split(
         dataset.drop(label_column, axis=1),
         dataset[label_column],
@@ -24,6 +32,11 @@ def split_to_train_and_test(dataset, label_column, test_ratio, rand_state):
 
 
 def get_classifier_obj(classifier_name, params):
+    from sklearn import tree
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.naive_bayes import GaussianNB
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.svm import SVC
     clf_map = {
         "KNN": KNeighborsClassifier,
         "naive_bayes": GaussianNB,
@@ -37,23 +50,21 @@ def get_classifier_obj(classifier_name, params):
 
 
 def calc_evaluation_val(eval_metric, y_test, y_predicted):
-    metric_map = {
-        'accuracy': metrics.accuracy_score,
-        'precision': metrics.precision_score,
-        'recall': metrics.recall_score,
-        'f1': metrics.f1_score,
-        'confusion_matrix': metrics.confusion_matrix
-    }
-    val = metric_map.get(eval_metric)
-    if val is None:
+    # precision, recall and f1 are weighted averages, every metric comes from one confusion matrix.
+    # evaluation_utils.evaluate_predictions returns all of them at once.
+    if eval_metric not in ['accuracy', 'precision', 'recall', 'f1', 'confusion_matrix']:
         return
-    kwargs = {}
-    if eval_metric in ['precision', 'recall', 'f1']:
-        kwargs['average'] = 'weighted'
-    return val(y_true=y_test, y_pred=y_predicted, **kwargs)
+    confusion_matrix = build_confusion_matrix(y_test, y_predicted)
+    if eval_metric == 'confusion_matrix':
+        return confusion_matrix
+    metrics, _, _ = get_confusion_metrics(confusion_matrix)
+    return float(metrics[eval_metric])
 
 
-def find_best_model(X_train, y_train, max_depth_val, min_samples_split_val):
+def find_best_model(X_train, y_train, max_depth_val, min_samples_split_val, X_test=None, y_test=None):
+    # Models are compared by weighted recall on the held out data when given, on the training data otherwise
+    if (X_test is None) != (y_test is None):
+        raise ValueError("X_test and y_test must be given together")
     algos = {
         'svm': {},
         'naive_bayes': {},
@@ -62,31 +73,108 @@ def find_best_model(X_train, y_train, max_depth_val, min_samples_split_val):
             'min_samples_split': min_samples_split_val
         }
     }
-    best_recall = -1
-    best_clf = None
+    models = {}
     for algo in algos:
-        clf = get_classifier_obj(algo, algos[algo])
-        clf.fit(X_train, y_train)
-        y_pred = clf.predict(X_train)
-        recall = calc_evaluation_val("recall", y_train, y_pred)
-        if recall > best_recall:
-            recall = best_recall
-            best_clf = clf
-
-    return best_clf, best_recall
-
-
-def find_best_k_for_KNN(X_train, y_train):
-    parameters = {'n_neighbors': [1,2,3,4,5,7,9,11,13,15,17,19]}
-    clf = GridSearchCV(
-        KNeighborsClassifier(),
-        parameters,
-        scoring=make_scorer(
-            metrics.accuracy_score,
-            greater_is_better=True
-        )
+        models[algo] = get_classifier_obj(algo, algos[algo])
+        models[algo].fit(X_train, y_train)
+
+    if X_test is None:
+        X_test, y_test = X_train, y_train
+    report = compare_models(models, X_test, y_test, n_bootstrap=0, sort_by="recall")
+    best = report.iloc[0]
+    return models[best["model"]], float(best["recall"])
+
+
+def find_best_k_for_KNN(X_train, y_train, n_jobs=-1):
+    # Same 5 fold accuracy search as GridSearchCV over n_neighbors, but every fold queries its KD tree once at the
+    # largest k instead of running a brute force search per k
+    from utils.knn_utils import score_k_values
+    k_scores = score_k_values(X_train, y_train, MODEL_PARAM_GRIDS["KNN"]["n_neighbors"], scale=False, n_jobs=n_jobs)
+    best_k = max(k_scores, key=k_scores.get)
+    return best_k, k_scores[best_k]
+
+
+def expand_param_grid(param_grid):
+    keys = sorted(param_grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*[param_grid[key] for key in keys])]
 
+
+def fit_and_score_fold(data_hash, classifier_name, params, train_idx, test_idx, eval_metric, X, y):
+    # X and y are left out of the memoization key, data_hash stands for them
+    start = time.perf_counter()
+    clf = get_classifier_obj(classifier_name, params)
+    clf.fit(X[train_idx], y[train_idx])
+    score = calc_evaluation_val(eval_metric, y[test_idx], clf.predict(X[test_idx]))
+    return score, time.perf_counter() - start
+
+
+def evaluate_candidates(candidates, X, y, sample_idx, cv, eval_metric, n_jobs, fold_func, data_hash, random_state):
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import StratifiedKFold
+    folds = list(StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state).split(
+        sample_idx, y[sample_idx]))
+    start = time.perf_counter()
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(fold_func)(data_hash, name, params, sample_idx[train], sample_idx[test], eval_metric, X, y)
+        for name, params in candidates for train, test in folds
     )
+    log("EVALUATED %s CANDIDATES ON %s ROWS IN %.2fs", len(candidates), len(sample_idx), time.perf_counter() - start)
+
+    rows = []
+    for index, (name, params) in enumerate(candidates):
+        scores, times = zip(*results[index * cv:(index + 1) * cv])
+        rows.append({
+            "classifier": name,
+            "params": params,
+            "n_samples": len(sample_idx),
+            "mean_score": np.mean(scores),
+            "std_score": np.std(scores),
+            # Sum of the folds' fit and predict times, as measured when each fold was first computed
+            "wall_time": sum(times),
+        })
+    return rows
+
+
+def run_model_selection(X, y, param_grids=None, cv=5, eval_metric="accuracy", n_jobs=-1,
+                        cache_dir=MODEL_CACHE_DIR, halving=False, factor=3, min_samples=None, random_state=0):
+    # Cross validates every (classifier, params) candidate in parallel. Folds are memoized on disk by
+    # (data hash, classifier, params, fold), so rerunning the same selection is instant.
+    # With halving=True candidates are raced on growing subsamples and only the best 1/factor go on.
+    from joblib import Memory, hash as joblib_hash
+    X = np.asarray(X)
+    y = np.asarray(y)
+    param_grids = param_grids or MODEL_PARAM_GRIDS
+    candidates = [(name, params) for name, grid in param_grids.items() for params in expand_param_grid(grid)]
+    data_hash = joblib_hash((X, y))
+    fold_func = fit_and_score_fold
+    if cache_dir:
+        fold_func = Memory(cache_dir, verbose=0).cache(fit_and_score_fold, ignore=["X", "y"])
+
+    order = np.random.default_rng(random_state).permutation(len(y))
+    sample_sizes = [len(y)]
+    if halving:
+        # Every round keeps 1/factor of the candidates on factor times more rows, the last round uses all rows
+        rounds_cnt = max(1, int(np.ceil(np.log(len(candidates)) / np.log(factor))))
+        sample_sizes = [max(min_samples or cv * 20, len(y) // factor ** (rounds_cnt - 1 - r))
+                        for r in range(rounds_cnt)]
+        sample_sizes[-1] = len(y)
+
+    report = []
+    for round_index, n_samples in enumerate(sample_sizes):
+        sample_idx = np.sort(order[:min(n_samples, len(y))])
+        rows = evaluate_candidates(candidates, X, y, sample_idx, cv, eval_metric, n_jobs, fold_func, data_hash,
+                                   random_state)
+        [row.update(round=round_index) for row in rows]
+        report.extend(rows)
+        if round_index == len(sample_sizes) - 1:
+            # Nothing to race after the last round, the only round without halving
+            break
+
+        ranked = sorted(range(len(rows)), key=lambda i: rows[i]["mean_score"], reverse=True)
+        candidates = [candidates[i] for i in ranked[:max(1, len(candidates) // factor)]]
 
-    clf.fit(X_train, y_train)
-    return clf.best_params_.get('n_neighbors'), clf.best_score_
\ No newline at end of file
+    report = pd.DataFrame(report).sort_values(["round", "mean_score"], ascending=[False, False], ignore_index=True)
+    best = report.iloc[0]
+    best_clf = get_classifier_obj(best["classifier"], best["params"])
+    best_clf.fit(X, y)
+    return best_clf, report
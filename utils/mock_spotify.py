@@ -0,0 +1,59 @@
+import random
+from collections import Counter
+from utils.general_utls import GENRE_LIST
+
+
+class MockSpotify:
+    # Offline stand-in for spotipy.Spotify covering the endpoints used by spotify_utils.
+    # Every call is counted in `call_counts` so tests can assert the number of round-trips.
+    def __init__(self, artists_cnt=20, seed=0):
+        rng = random.Random(seed)
+        self.call_counts = Counter()
+        self.artists_db = {
+            f"artist{i}": {
+                "id": f"artist{i}",
+                "name": f"Mock Artist {i}",
+                "genres": rng.sample(GENRE_LIST, 2),
+            }
+            for i in range(artists_cnt)
+        }
+
+    def make_track(self, index):
+        artist = self.artists_db[f"artist{index % len(self.artists_db)}"]
+        return {
+            "id": f"track{index}",
+            "uri": f"spotify:track:track{index}",
+            "name": f"Mock Song {index}",
+            "artists": [{"id": artist["id"], "name": artist["name"]}],
+            "album": {"release_date": f"{1980 + index % 44}-0{1 + index % 9}-01"},
+            "duration_ms": 120000 + index,
+            "popularity": index % 100,
+        }
+
+    def search(self, q, limit=10, offset=0, type="track"):
+        self.call_counts["search"] += 1
+        return {"tracks": {"items": [self.make_track(i) for i in range(offset, offset + limit)]}}
+
+    def artist(self, artist_id):
+        self.call_counts["artist"] += 1
+        return self.artists_db[artist_id]
+
+    def artists(self, artists):
+        self.call_counts["artists"] += 1
+        if len(artists) > 50:
+            raise ValueError("Too many ids requested")
+        return {"artists": [self.artists_db.get(artist_id) for artist_id in artists]}
+
+    def audio_features(self, tracks=None):
+        self.call_counts["audio_features"] += 1
+        tracks = [tracks] if isinstance(tracks, str) else tracks
+        if len(tracks) > 100:
+            raise ValueError("Too many ids requested")
+        return [self.make_audio_features(uri) for uri in tracks]
+
+    @staticmethod
+    def make_audio_features(uri):
+        rng = random.Random(uri)
+        return {"uri": uri, **{key: rng.random() for key in
+                               ["danceability", "energy", "key", "loudness", "speechiness", "acousticness",
+                                "instrumentalness", "liveness", "valence", "tempo"]}}
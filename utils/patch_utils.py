@@ -1,27 +1,17 @@
-import ast
-from utils.general_utls import get_common_genre, is_file_valid
-from utils.lyrics_utils import LyricsHandler
+from utils.batch_utils import extract_features_batch, merge_features
+from utils.general_utls import label_common_genres
+from utils.metrics_utils import log
 
 
-def recalculate_dataset(dataset_df):
-    for i, row in dataset_df.iterrows():
-        genre_list = row["genres"]
-        # Convert genres back to list
-        genre_list = ast.literal_eval(genre_list)
-        recalculate_common_genre = get_common_genre(genre_list)
-        if recalculate_common_genre != row['common_genre']:
-            print(f"common_genre CHANGED FROM {row['common_genre']} TO {recalculate_common_genre}")
-            dataset_df.at[i, 'common_genre'] = recalculate_common_genre
+def recalculate_dataset(dataset_df, workers=None, chunk_size=64, seed=None):
+    common_genres = label_common_genres(dataset_df["genres"], seed)
+    changed = common_genres.ne(dataset_df["common_genre"])
+    for old_genre, new_genre in zip(dataset_df.loc[changed, "common_genre"], common_genres[changed]):
+        log("common_genre CHANGED FROM %s TO %s", old_genre, new_genre)
+    dataset_df.loc[changed, "common_genre"] = common_genres[changed]
 
-        lyrics_file = row["lyrics_file"]
-        if not is_file_valid(lyrics_file):
-            print("LYRICS FILE IS NOT FOUND OR NOT VALID")
-            continue
+    # Files that are missing or not valid are skipped and keep their current features
+    lyrics_features = extract_features_batch(dataset_df["lyrics_file"].tolist(), workers, chunk_size)
+    merge_features(dataset_df, lyrics_features)
 
-        print(f"INIT HANDLER FOR FILE: {lyrics_file}")
-        lyrics_handler = LyricsHandler(lyrics_file)
-        lyrics_features = lyrics_handler.extract_lyrics_features()
-        for feature in lyrics_features:
-            dataset_df.at[i, feature] = lyrics_features[feature]
-
-    print("DONE")
+    log("DONE")
@@ -1,8 +1,13 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import seaborn as sns
 import math
+from utils.encoding_utils import CategoricalEncoder
+
+# matplotlib and seaborn are imported inside the plotting functions, they are slow to import and
+# transfer_str_to_numeric_vals does not need them
+
+# Above this many rows scatter plots become hexbins (or stratified samples) and histograms are binned with numpy
+PLOT_ROWS_THRESHOLD = 20000
 
 
 def one_dim_plot(sr, plot_type, axis):
@@ -21,6 +26,7 @@ def get_frequent_elements(df, col_name, num_top_elements):
 
 
 def plot_frequent_elements(df, df_params):
+    import matplotlib.pyplot as plt
     fig, axs = plt.subplots(1, len(df_params), figsize=(20, 5))
     axs = np.array(axs).reshape(-1)
     for i, row in df_params.iterrows():
@@ -38,6 +44,7 @@ def cross_tabulation(df, col_name, other_col_name):
 
 
 def plot_cross_tabulation(df, col_names, other_col_name):
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(1, len(col_names), figsize=(20, 5))
     for i, col_name in enumerate(col_names):
         one_dim_plot(cross_tabulation(df, col_name, other_col_name), "line", axes[i])
@@ -45,36 +52,81 @@ def plot_cross_tabulation(df, col_names, other_col_name):
         axes[i].set_ylabel(other_col_name)
 
 
-def get_highly_correlated_cols(df):
-    corr = df.select_dtypes("number", "category").corr()
-    n = corr.shape[0]
-    correlated_cols = []
-    for i in range(n):
-        for j in range(i + 1, n):
-            if abs(corr.iloc[i, j]) >= 0.5:
-                correlated_cols.append((i, j))
-    correlations = [corr.iloc[i, j] for i, j in correlated_cols]
+def get_correlation_matrix(df):
+    return df.select_dtypes("number", "category").corr()
+
+
+def get_highly_correlated_cols(df, corr=None, threshold=0.5):
+    # Pairs (i, j), i < j, of correlation matrix positions in row order, pass corr to reuse a computed matrix
+    corr = get_correlation_matrix(df) if corr is None else corr
+    values = corr.to_numpy()
+    rows, cols = np.triu_indices(len(values), k=1)
+    pair_values = values[rows, cols]
+    # NaN correlations (constant columns) are never high
+    high = np.abs(np.nan_to_num(pair_values)) >= threshold
+    correlations = pair_values[high].tolist()
+    correlated_cols = list(zip(rows[high].tolist(), cols[high].tolist()))
     return correlations, correlated_cols
 
 
-def plot_high_correlated_scatters(df):
-    _, tuple_arr = get_highly_correlated_cols(df)
+def sample_rows(df, max_rows, stratify_col=None, seed=0):
+    # Uniform sample, or one keeping the share of every stratify_col value
+    if len(df) <= max_rows:
+        return df
+    if stratify_col is None:
+        return df.sample(max_rows, random_state=seed)
+    return df.groupby(stratify_col, group_keys=False, observed=True).sample(
+        frac=max_rows / len(df), random_state=seed)
 
-    fig, axes = plt.subplots(nrows=1, ncols=len(tuple_arr))
 
-    for i, (col1, col2) in enumerate(tuple_arr):
-        axes[i].scatter(df.iloc[:, col1], df.iloc[:, col2])
-        corr_val = df.iloc[:, [col1, col2]].corr().iloc[0, 1]
-        title = f"corr('{df.columns[col1]}', '{df.columns[col2]}')={corr_val:4.2f}"
+def plot_pair_relation(df, x, y, axis, max_points=PLOT_ROWS_THRESHOLD, stratify_col=None):
+    # Hexbin density above max_points rows, unless a stratified sample is asked for
+    if len(df) <= max_points or stratify_col is not None:
+        sampled = sample_rows(df, max_points, stratify_col)
+        axis.scatter(sampled[x], sampled[y])
+    else:
+        values = df[[x, y]].dropna()
+        axis.hexbin(values[x], values[y], gridsize=50, mincnt=1, bins="log")
+    axis.set_xlabel(x)
+    axis.set_ylabel(y)
+
+
+def plot_high_correlated_scatters(df, corr=None, threshold=0.5, max_points=PLOT_ROWS_THRESHOLD, stratify_col=None):
+    import matplotlib.pyplot as plt
+    corr = get_correlation_matrix(df) if corr is None else corr
+    correlations, tuple_arr = get_highly_correlated_cols(df, corr, threshold)
+    if not tuple_arr:
+        return
+
+    fig, axes = plt.subplots(nrows=1, ncols=len(tuple_arr), figsize=(5 * len(tuple_arr), 5))
+    axes = np.array(axes).reshape(-1)
+
+    for i, ((col1, col2), corr_val) in enumerate(zip(tuple_arr, correlations)):
+        # Positions are in the correlation matrix, which only has the numeric columns
+        name1, name2 = corr.columns[col1], corr.columns[col2]
+        plot_pair_relation(df, name1, name2, axes[i], max_points, stratify_col)
+        title = f"corr('{name1}', '{name2}')={corr_val:4.2f}"
         axes[i].set_title(title)
 
 
-def transfer_str_to_numeric_vals(dataset):
-    # Transfer dataset's values to numeric ones
-    for column in dataset.columns:
-        labels = dataset[column].astype("category").cat.categories.to_list()
-        lab_map = {value: index for index, value in enumerate(labels)}
-        dataset[column] = dataset[column].map(lab_map)
+def run_correlation_eda(df, threshold=0.5, max_points=PLOT_ROWS_THRESHOLD, stratify_col=None):
+    # One correlation matrix for the pair extraction, the titles and the caller
+    corr = get_correlation_matrix(df)
+    correlations, correlated_cols = get_highly_correlated_cols(df, corr, threshold)
+    plot_high_correlated_scatters(df, corr, threshold, max_points, stratify_col)
+    return corr, correlations, correlated_cols
+
+
+def transfer_str_to_numeric_vals(dataset, encoder=None):
+    # Transfer dataset's values to numeric ones, pass a fitted encoder to reuse the training data codes
+    encoder = encoder or CategoricalEncoder(dataset.columns).fit(dataset)
+    encoded = encoder.transform(dataset)
+    for column in encoder.columns:
+        if column not in dataset.columns:
+            continue
+        # Missing values stay missing
+        missing = dataset[column].isna()
+        dataset[column] = encoded[column].mask(missing) if missing.any() else encoded[column]
 
     return dataset
 
@@ -95,7 +147,17 @@ def plot_frequencies(dataset, cols, plot_type, num_top=None):
         )
 
 
-def plot_histograms(dataset, cols):
+def plot_binned_histogram(values, axis, bins=50):
+    # Counts are computed by numpy, matplotlib only draws the bins
+    values = values.dropna().to_numpy(dtype="float64")
+    counts, edges = np.histogram(values, bins=bins)
+    axis.stairs(counts, edges, fill=True)
+    axis.set_ylabel("Count")
+
+
+def plot_histograms(dataset, cols, max_points=PLOT_ROWS_THRESHOLD):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     cols_cnt = min(len(cols), 3)
     rows_cnt = math.ceil((len(cols) / 3))
 
@@ -103,14 +165,23 @@ def plot_histograms(dataset, cols):
         fig, axs = plt.subplots(1, min(cols_cnt, len(cols) - ridx * 3), figsize=(20, 5))
         axs = np.array(axs).reshape(-1)
         for i, col in enumerate(cols[ridx * 3:ridx * 3 + 3]):
-            sns.histplot(dataset[col], ax=axs[i])
+            if len(dataset) > max_points and pd.api.types.is_numeric_dtype(dataset[col]):
+                plot_binned_histogram(dataset[col], axs[i])
+                axs[i].set_xlabel(col)
+            else:
+                sns.histplot(dataset[col], ax=axs[i])
 
 
-def plot_continuous_feature_relations(dataset, continuous_vars):
+def plot_continuous_feature_relations(dataset, continuous_vars, max_points=PLOT_ROWS_THRESHOLD, stratify_col=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     var_combinations = [(var1, var2) for var1 in continuous_vars for var2 in continuous_vars if var1 < var2]
     rows_num = math.ceil(len(var_combinations) / 3)
     for row_index in range(rows_num):
         fig, axs = plt.subplots(1, 3, figsize=(20, 5))
         axs = axs.flatten()
         for index, feature in enumerate(var_combinations[3 * row_index:3 * row_index + 3]):
-            sns.scatterplot(dataset, x=feature[0], y=feature[1], ax=axs[index % 3])
\ No newline at end of file
+            if len(dataset) > max_points:
+                plot_pair_relation(dataset, feature[0], feature[1], axs[index % 3], max_points, stratify_col)
+            else:
+                sns.scatterplot(dataset, x=feature[0], y=feature[1], ax=axs[index % 3])
\ No newline at end of file
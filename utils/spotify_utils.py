@@ -1,63 +1,182 @@
 import json
 import os
 import os.path as osp
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from utils.general_utls import is_file_valid, purify_text, get_common_genre
-from utils.lyrics_utils import fetch_lyrics, LyricsHandler, save_lyrics
-
-
-with open(osp.join(osp.dirname(osp.abspath(__file__)), 'creds.json'), 'r') as fp:
-    creds_dict = json.load(fp)
-
-spotify = spotipy.Spotify(
-    client_credentials_manager=SpotifyClientCredentials(**creds_dict)
-)
+from utils.cache_utils import MetadataCache
+from utils.general_utls import purify_text, get_common_genre
+from utils.lyrics_utils import fetch_lyrics, extract_lyrics_features_cached, save_lyrics, is_lyrics_available
+from utils.metrics_utils import count, log, timed
+
+CREDS_FILE_PATH = osp.join(osp.dirname(osp.abspath(__file__)), 'creds.json')
+SPOTIFY_CACHE_PATH = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), 'spotify_cache.sqlite')
+# Max ids per request of the multi-id spotify endpoints
+ARTISTS_BATCH_SIZE = 50
+AUDIO_FEATURES_BATCH_SIZE = 100
+AUDIO_FEATURE_KEYS = ["danceability", "energy", "key", "loudness", "speechiness", "acousticness",
+                      "instrumentalness", "liveness", "valence", "tempo"]
+
+_spotify = None
+_metadata_cache = None
+
+
+def get_spotify_client():
+    global _spotify
+    if _spotify is None:
+        import spotipy
+        from spotipy.oauth2 import SpotifyClientCredentials
+        with open(CREDS_FILE_PATH, 'r') as fp:
+            creds_dict = json.load(fp)
+
+        _spotify = spotipy.Spotify(
+            client_credentials_manager=SpotifyClientCredentials(**creds_dict)
+        )
+    return _spotify
+
+
+def set_spotify_client(client):
+    # Allows running against utils.mock_spotify.MockSpotify offline
+    global _spotify
+    _spotify = client
+
+
+def get_metadata_cache():
+    global _metadata_cache
+    if _metadata_cache is None:
+        _metadata_cache = MetadataCache(SPOTIFY_CACHE_PATH)
+    return _metadata_cache
+
+
+def split_to_batches(items, batch_size):
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def get_artists(artist_ids, cache=None):
+    cache = cache or get_metadata_cache()
+    artists = cache.get_many("artist", artist_ids)
+    missing = [artist_id for artist_id in dict.fromkeys(artist_ids) if artist_id not in artists]
+    for batch in split_to_batches(missing, ARTISTS_BATCH_SIZE):
+        log("FETCHING %s ARTISTS", len(batch))
+        count("spotify_requests", endpoint="artists")
+        with timed("spotify"):
+            response = get_spotify_client().artists(batch)
+        fetched = {artist["id"]: artist for artist in response.get("artists", []) if artist}
+        cache.set_many("artist", fetched)
+        artists.update(fetched)
+
+    return artists
+
+
+def get_audio_features(track_uris, cache=None):
+    cache = cache or get_metadata_cache()
+    features = cache.get_many("audio_features", track_uris)
+    missing = [uri for uri in dict.fromkeys(track_uris) if uri not in features]
+    for batch in split_to_batches(missing, AUDIO_FEATURES_BATCH_SIZE):
+        log("FETCHING AUDIO FEATURES FOR %s TRACKS", len(batch))
+        count("spotify_requests", endpoint="audio_features")
+        with timed("spotify"):
+            response = get_spotify_client().audio_features(batch)
+        fetched = {uri: item for uri, item in zip(batch, response) if item}
+        cache.set_many("audio_features", fetched)
+        features.update(fetched)
+
+    return features
 
 
 def fetch_tracks(search_query=None, limit=10, offset=0):
     if search_query is None:
         search_query = ""
-    print(f"SEARCH QUERY: {search_query}")
-    response = spotify.search(search_query, limit=limit, offset=offset, type="track")
+    log("SEARCH QUERY: %s", search_query)
+    count("spotify_requests", endpoint="search")
+    with timed("spotify"):
+        response = get_spotify_client().search(search_query, limit=limit, offset=offset, type="track")
     return response.get("tracks", {}).get("items", [])
 
 
+def add_lyrics_location(track_data):
+    purified_artists = purify_text(track_data.get('artists'))
+    purified_name = purify_text(track_data.get('name'))
+    track_data["lyrics_file"] = os.path.join("song_lyrics", f"{purified_artists}-{purified_name}.txt")
+    track_data["lyrics_url"] = f"https://genius.com/{purified_artists}-{purified_name}-lyrics"
+    return track_data
+
+
 def fetch_track_data(track_obj):
     try:
-        track_data = extract_tracks_data(track_obj, audio_features=False)
-        purified_artists = purify_text(track_data.get('artists'))
-        purified_name = purify_text(track_data.get('name'))
-        genius_url = f"https://genius.com/{purified_artists}-{purified_name}-lyrics"
-        lyrics_file = os.path.join("song_lyrics", f"{purified_artists}-{purified_name}.txt")
-        track_data["lyrics_file"] = lyrics_file
-        track_data["lyrics_url"] = genius_url
-        if not is_file_valid(lyrics_file):
-            print("LYRICS FILE IS NOT FOUND OR NOT VALID")
+        track_data = add_lyrics_location(extract_tracks_data(track_obj, audio_features=False))
+        lyrics_file = track_data["lyrics_file"]
+        genius_url = track_data["lyrics_url"]
+        if not is_lyrics_available(lyrics_file):
+            log("LYRICS FILE IS NOT FOUND OR NOT VALID")
             lyrics = fetch_lyrics(genius_url)
             if not lyrics:
-                print("RETURNS PARTIAL DATA DUE TO LYRICS FETCH FAILURE")
+                log("RETURNS PARTIAL DATA DUE TO LYRICS FETCH FAILURE")
                 return track_data
 
             save_lyrics(''.join(lyrics), lyrics_file)
 
-        print(f"INIT HANDLER FOR FILE: {lyrics_file}")
-        lyrics_handler = LyricsHandler(lyrics_file)
-        lyrics_features = lyrics_handler.extract_lyrics_features()
-        print(f"EXTRACTED FEATURES:\n{lyrics_features}")
+        lyrics_features = extract_lyrics_features_cached(lyrics_file)
+        log("EXTRACTED FEATURES:\n%s", lyrics_features)
         track_data.update(lyrics_features)
 
         return track_data
 
     except Exception as err:
-        print(f"FAILED FETCH TRACK DATA: {err}")
+        log("FAILED FETCH TRACK DATA: %s", err)
+
 
+def fetch_tracks_data(track_objs, fetcher):
+    # Same as fetch_track_data for a whole page of tracks, missing lyrics are downloaded concurrently
+    tracks_data = [add_lyrics_location(track_data) if track_data is not None else None
+                   for track_data in extract_tracks_data_batch(track_objs, audio_features=False)]
 
-def extract_tracks_data(track, audio_features=False):
-    print(f"EXTRACTING TRACK FEATURES, AUDIO FEATURES = {audio_features}")
+    missing = {data["lyrics_file"]: data["lyrics_url"] for data in tracks_data
+               if data is not None and not is_lyrics_available(data["lyrics_file"])}
+    fetcher.fetch_and_save_many([(url, lyrics_file) for lyrics_file, url in missing.items()], separator='')
+
+    for track_data in tracks_data:
+        if track_data is None:
+            continue
+        if not is_lyrics_available(track_data["lyrics_file"]):
+            log("RETURNS PARTIAL DATA DUE TO LYRICS FETCH FAILURE")
+            continue
+        try:
+            track_data.update(extract_lyrics_features_cached(track_data["lyrics_file"]))
+        except Exception as err:
+            log("FAILED EXTRACTING LYRICS FEATURES: %s", err)
+
+    return tracks_data
+
+
+def extract_tracks_data_batch(tracks, audio_features=False):
+    # Artists and audio features of the whole page are fetched with a constant number of requests
+    try:
+        artists_info = get_artists([track.get("artists", [])[0].get("id") for track in tracks])
+        tracks_audio_features = get_audio_features([track.get("uri") for track in tracks]) if audio_features else {}
+    except Exception as err:
+        log("FAILED BATCH FETCH, FALLING BACK TO PER TRACK REQUESTS: %s", err)
+        artists_info, tracks_audio_features = {}, {}
+
+    tracks_data = []
+    for track in tracks:
+        try:
+            tracks_data.append(extract_tracks_data(
+                track,
+                audio_features,
+                artist_info=artists_info.get(track.get("artists", [])[0].get("id")),
+                track_audio_features=tracks_audio_features.get(track.get("uri"))
+            ))
+        except Exception as err:
+            log("FAILED FETCH TRACK DATA: %s", err)
+            tracks_data.append(None)
+
+    return tracks_data
+
+
+def extract_tracks_data(track, audio_features=False, artist_info=None, track_audio_features=None):
+    log("EXTRACTING TRACK FEATURES, AUDIO FEATURES = %s", audio_features)
     artists = track.get("artists", [])[0]
     artist_id = artists.get("id")
-    artist_info = spotify.artist(artist_id)
+    if artist_info is None:
+        artist_info = get_artists([artist_id])[artist_id]
     artist_genres = artist_info.get("genres", [])
     release_date = track.get("album", {}).get("release_date")
 
@@ -73,15 +192,13 @@ def extract_tracks_data(track, audio_features=False):
     }
 
     if audio_features:
-        track_audio_features = spotify.audio_features(track.get("uri"))[0]
-        track_dict.update(**{key: float(track_audio_features.get(key)) for key in
-                             ["danceability", "energy", "key", "loudness", "speechiness", "acousticness",
-                              "instrumentalness",
-                              "liveness", "valence", "tempo"]})
+        if track_audio_features is None:
+            track_audio_features = get_audio_features([track.get("uri")])[track.get("uri")]
+        track_dict.update(**{key: float(track_audio_features.get(key)) for key in AUDIO_FEATURE_KEYS})
 
     return track_dict
 
 
 if __name__ == '__main__':
-    test = spotify.artist("6zVFRTB0Y1whWyH7ZNmywf")
+    test = get_spotify_client().artist("6zVFRTB0Y1whWyH7ZNmywf")
     print(test)
@@ -0,0 +1,166 @@
+import ast
+import glob
+import json
+import os
+import os.path as osp
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from utils.metrics_utils import log
+
+LIST_COLUMNS = ["genres"]
+INT_COLUMNS = ["release_year", "release_month", "duration", "popularity"]
+FLOAT_COLUMNS = ["positive", "negative", "neutral", "compound", "pos", "neg", "neu", "lyrics_mtime"]
+# Stores with key columns are upserted: a row replaces the rows of older partitions with the same key
+STORE_META_FILE = "_store.json"
+# Unique row key of updatable stores, song name and artists are not unique in the crawled data
+ROW_ID_COLUMN = "row_id"
+
+
+def parse_list_value(value):
+    # Lists read back from csv files are stringified python lists
+    if isinstance(value, str):
+        return list(ast.literal_eval(value))
+    if value is None or (not hasattr(value, "__len__") and pd.isna(value)):
+        return None
+    return list(value)
+
+
+def normalize_dataset_types(df):
+    df = df.copy()
+    for col in df.columns:
+        if col in LIST_COLUMNS:
+            df[col] = df[col].map(parse_list_value)
+        elif col in FLOAT_COLUMNS:
+            df[col] = df[col].astype("float64")
+        elif col in INT_COLUMNS or col.endswith("_cnt"):
+            values = pd.to_numeric(df[col])
+            # Counts read from csv files become floats when a value is missing, store them as nullable ints
+            if (values.dropna() % 1 == 0).all():
+                df[col] = values.astype("Int64")
+
+    return df
+
+
+def get_partition_files(store_dir):
+    return sorted(glob.glob(osp.join(store_dir, "part-*.parquet")))
+
+
+def get_store_key_columns(store_dir):
+    meta_path = osp.join(store_dir, STORE_META_FILE)
+    if not osp.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as fp:
+        return json.load(fp).get("key_columns")
+
+
+def set_store_key_columns(store_dir, key_columns):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(osp.join(store_dir, STORE_META_FILE), 'w') as fp:
+        json.dump({"key_columns": list(key_columns)}, fp)
+
+
+def save_dataset_partition(data, store_dir):
+    if not isinstance(data, pd.DataFrame):
+        data = pd.DataFrame(data)
+
+    os.makedirs(store_dir, exist_ok=True)
+    # Partition names sort in write order
+    partition_path = osp.join(store_dir, f"part-{time.time_ns():020d}.parquet")
+    table = pa.Table.from_pandas(normalize_dataset_types(data), preserve_index=False)
+    pq.write_table(table, partition_path)
+    return partition_path
+
+
+def load_dataset_store(store_dir, columns=None, filters=None):
+    # filters use the pyarrow/pandas DNF format, e.g. [("popularity", ">", 50), ("genre", "in", ["pop", "rock"])]
+    if not osp.isdir(store_dir):
+        # A mistyped path must not load as an empty dataset
+        raise FileNotFoundError(f"Dataset store '{store_dir}' does not exist")
+    files = get_partition_files(store_dir)
+    if not files:
+        return pd.DataFrame(columns=columns or [])
+
+    # Partitions written by different crawls may miss some columns, read them with one merged schema
+    schema = pa.unify_schemas([pq.read_schema(f) for f in files], promote_options="permissive")
+    dataset = ds.dataset(files, schema=schema, format="parquet")
+    key_columns = get_store_key_columns(store_dir)
+    if key_columns:
+        table = load_latest_rows(dataset, key_columns, columns, filters)
+    else:
+        table = dataset.to_table(
+            columns=columns,
+            filter=pq.filters_to_expression(filters) if filters else None
+        )
+
+    df = table.to_pandas()
+    for col in LIST_COLUMNS:
+        if col in df.columns:
+            df[col] = table.column(col).to_pylist()
+
+    return df
+
+
+def load_latest_rows(dataset, key_columns, columns=None, filters=None):
+    # Keys are deduplicated before filtering, so an old version of a row never shows up when its update is
+    # filtered out. Partitions are read in write order, the last row of every key is the current one.
+    keys = dataset.to_table(columns=key_columns).to_pandas()
+    latest = np.flatnonzero(~keys.duplicated(key_columns, keep="last").to_numpy())
+    # Filter columns may not be among the requested ones, read everything when filtering
+    table = dataset.to_table(columns=None if filters else columns).take(latest)
+    if filters:
+        table = table.filter(pq.filters_to_expression(filters))
+        if columns is not None:
+            table = table.select(columns)
+    return table
+
+
+def assign_row_ids(store_dir):
+    # Numbers the rows of a store without key columns and makes row_id its key, rewriting it as one partition
+    if get_store_key_columns(store_dir) is not None:
+        raise ValueError(f"'{store_dir}' already has key columns {get_store_key_columns(store_dir)}")
+    files = get_partition_files(store_dir)
+    df = load_dataset_store(store_dir)
+    if files:
+        df[ROW_ID_COLUMN] = np.arange(len(df), dtype="int64")
+        save_dataset_partition(df, store_dir)
+    for f in files:
+        os.remove(f)
+    set_store_key_columns(store_dir, [ROW_ID_COLUMN])
+    log("ASSIGNED ROW IDS TO %s ROWS OF '%s'", len(df), store_dir)
+
+
+def get_next_row_id(store_dir):
+    row_ids = load_dataset_store(store_dir, columns=[ROW_ID_COLUMN])[ROW_ID_COLUMN]
+    return int(row_ids.max()) + 1 if len(row_ids) else 0
+
+
+def compact_dataset_store(store_dir):
+    # Rewrites all partitions as one, useful after many small appends
+    files = get_partition_files(store_dir)
+    if len(files) < 2:
+        return
+
+    save_dataset_partition(load_dataset_store(store_dir), store_dir)
+    for f in files:
+        os.remove(f)
+
+
+def migrate_csv_to_store(csv_path, store_dir, chunk_size=100000):
+    log("MIGRATING '%s' TO '%s'", csv_path, store_dir)
+    rows_cnt = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        save_dataset_partition(chunk, store_dir)
+        rows_cnt += len(chunk)
+
+    log("MIGRATED %s ROWS", rows_cnt)
+    return rows_cnt
+
+
+if __name__ == '__main__':
+    root_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+    for file_name in ["dataset.csv", "dataset_test.csv"]:
+        migrate_csv_to_store(osp.join(root_dir, file_name), osp.join(root_dir, file_name.replace(".csv", "")))
@@ -0,0 +1,258 @@
+import os
+import numpy as np
+import pandas as pd
+from utils.general_utls import is_dataset_store
+from utils.metrics_utils import log
+
+
+def iter_dataset_chunks(filepath, chunk_size=100000, columns=None):
+    if not is_dataset_store(filepath):
+        yield from pd.read_csv(filepath, chunksize=chunk_size, usecols=columns)
+        return
+
+    import pyarrow.dataset as ds
+    from utils.store_utils import get_partition_files, LIST_COLUMNS
+    if not os.path.isdir(filepath):
+        raise FileNotFoundError(f"Dataset store '{filepath}' does not exist")
+    for batch in ds.dataset(get_partition_files(filepath), format="parquet").to_batches(
+            columns=columns, batch_size=chunk_size):
+        chunk = batch.to_pandas()
+        for col in LIST_COLUMNS:
+            if col in chunk.columns:
+                chunk[col] = batch.column(col).to_pylist()
+        yield chunk
+
+
+class MomentsAccumulator:
+    # Per column count, mean and sum of squared deviations, merged with Chan's parallel formula
+    def __init__(self, cols_cnt):
+        self.count = np.zeros(cols_cnt)
+        self.mean = np.zeros(cols_cnt)
+        self.m2 = np.zeros(cols_cnt)
+
+    def update(self, values):
+        other = MomentsAccumulator(values.shape[1])
+        other.count = np.sum(~np.isnan(values), axis=0).astype("float64")
+        with np.errstate(invalid="ignore"):
+            other.mean = np.where(other.count > 0, np.nanmean(values, axis=0), 0)
+        other.m2 = np.nansum((values - other.mean) ** 2, axis=0)
+        self.merge(other)
+
+    def merge(self, other):
+        count = self.count + other.count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = other.mean - self.mean
+            mean = np.where(count > 0, self.mean + delta * other.count / count, 0)
+            m2 = self.m2 + other.m2 + np.where(count > 0, delta ** 2 * self.count * other.count / count, 0)
+        self.count, self.mean, self.m2 = count, mean, m2
+
+    def std(self):
+        # Sample std (ddof=1) like pandas
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(self.m2 / (self.count - 1))
+
+
+class RowSampleAccumulator:
+    # Bottom-k sample: every row gets a random key and the k rows with the smallest keys are kept.
+    # Two samples merge by keeping the k smallest keys of both, so it is exact while fewer than k rows were seen
+    def __init__(self, sample_size, seed=0):
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0)
+        self.values = None
+
+    def update(self, values):
+        keys = self.rng.random(len(values))
+        self.merge_arrays(keys, values)
+
+    def merge(self, other):
+        if other.values is not None:
+            self.merge_arrays(other.keys, other.values)
+
+    def merge_arrays(self, keys, values):
+        if self.values is not None:
+            keys = np.concatenate([self.keys, keys])
+            values = np.concatenate([self.values, values])
+        if len(keys) > self.sample_size:
+            keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+            keys, values = keys[keep], values[keep]
+        self.keys, self.values = keys, values
+
+
+class RangeAccumulator:
+    # Per column min and max of the values that are not outliers. Collected in a second pass, once the outlier
+    # bounds of the first pass are known, so any number of outliers in a tail is handled.
+    def __init__(self, cols_cnt):
+        self.low = np.full(cols_cnt, np.inf)
+        self.high = np.full(cols_cnt, -np.inf)
+        self.has_outliers = np.zeros(cols_cnt, dtype=bool)
+
+    def update(self, values, outliers):
+        excluded = outliers | np.isnan(values)
+        self.low = np.minimum(self.low, np.where(excluded, np.inf, values).min(axis=0, initial=np.inf))
+        self.high = np.maximum(self.high, np.where(excluded, -np.inf, values).max(axis=0, initial=-np.inf))
+        self.has_outliers |= outliers.any(axis=0)
+
+    def merge(self, other):
+        self.low = np.minimum(self.low, other.low)
+        self.high = np.maximum(self.high, other.high)
+        self.has_outliers |= other.has_outliers
+
+
+class StreamingStats:
+    # Everything CleaningPipeline.fit needs, collected chunk by chunk
+    def __init__(self, numeric_cols, categorical_cols=(), label_col=None, sample_size=100000, seed=0):
+        self.numeric_cols = list(numeric_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.label_col = label_col
+        self.moments = MomentsAccumulator(len(self.numeric_cols))
+        self.sample = RowSampleAccumulator(sample_size, seed)
+        self.ranges = RangeAccumulator(len(self.numeric_cols))
+        self.unique_values = {col: set() for col in self.categorical_cols}
+        self.labels = set()
+        self.rows_cnt = 0
+
+    def update(self, chunk):
+        values = chunk[self.numeric_cols].to_numpy(dtype="float64")
+        self.moments.update(values)
+        self.sample.update(values)
+        for col in self.categorical_cols:
+            self.unique_values[col].update(chunk[col].dropna().unique())
+        if self.label_col is not None:
+            self.labels.update(chunk[self.label_col].dropna().unique())
+        self.rows_cnt += len(chunk)
+
+    def update_ranges(self, chunk, pipeline):
+        # Second pass, the pipeline's outlier stats are already set from the first one
+        values = chunk[self.numeric_cols].to_numpy(dtype="float64")
+        self.ranges.update(values, pipeline.get_outlier_mask(values))
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sample.merge(other.sample)
+        self.ranges.merge(other.ranges)
+        for col in self.categorical_cols:
+            self.unique_values[col].update(other.unique_values[col])
+        self.labels.update(other.labels)
+        self.rows_cnt += other.rows_cnt
+
+
+def apply_streaming_stats(pipeline, stats):
+    # Sets the fitted state of a CleaningPipeline from accumulated stats instead of calling fit() on a frame.
+    # Medians and IQR quantiles come from the row sample, exact as long as the data fits in the sample.
+    # Bin edges need the second pass ranges, they are set by apply_bin_ranges.
+    pipeline.numeric_cols = stats.numeric_cols
+    sample = stats.sample.values
+    if pipeline.outlier_method == "z_score":
+        pipeline.outlier_stats = stats.moments.mean, stats.moments.std()
+    else:
+        q1 = np.nanquantile(sample, 0.25, axis=0)
+        q3 = np.nanquantile(sample, 0.75, axis=0)
+        iqr = q3 - q1
+        pipeline.outlier_stats = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+    sample = sample.copy()
+    sample[pipeline.get_outlier_mask(sample)] = np.nan
+    pipeline.medians = np.nanmedian(sample, axis=0)
+
+    col_index = {col: index for index, col in enumerate(stats.numeric_cols)}
+    for col in pipeline.categorical_cols:
+        index = col_index[col]
+        values = np.array(sorted(stats.unique_values[col]), dtype="float64")
+        outliers = pipeline.get_outlier_mask(values, index)
+        categories = set(values[~outliers])
+        if outliers.any() or stats.moments.count[index] < stats.rows_cnt:
+            # Outliers and missing values are repaired with the median
+            categories.add(pipeline.medians[index])
+        categories = np.array(sorted(categories))
+        pipeline.categories[col] = np.unique(categories.astype("int64")) if col in pipeline.int_cols else categories
+
+    return pipeline
+
+
+def apply_bin_ranges(pipeline, stats):
+    col_index = {col: index for index, col in enumerate(stats.numeric_cols)}
+    for col in pipeline.bin_cols:
+        index = col_index[col]
+        bounds = np.array([stats.ranges.low[index], stats.ranges.high[index]])
+        if stats.ranges.has_outliers[index]:
+            # Outliers are repaired with the median before binning
+            bounds = np.array([min(bounds[0], pipeline.medians[index]), max(bounds[1], pipeline.medians[index])])
+        if col in pipeline.int_cols:
+            bounds = bounds.astype("int64")
+        # pd.cut edges only depend on the min and max of the column
+        _, pipeline.bin_edges[col] = pd.cut(bounds, pipeline.bins_cnt, retbins=True)
+
+    return pipeline
+
+
+def get_new_keys_mask(keys, seen_keys):
+    # True for the first row of every key not in seen_keys, which is updated. Linear in the chunk, the set holds
+    # one 64 bit hash per distinct row
+    seen = np.fromiter(map(seen_keys.__contains__, keys.tolist()), dtype=bool, count=len(keys))
+    keep = ~pd.Series(keys).duplicated().to_numpy() & ~seen
+    seen_keys.update(keys[keep].tolist())
+    return keep
+
+
+def iter_clean_chunks(filepath, chunk_size=100000, columns=None, keep_masks=None):
+    # Drops rows with missing values and (name, artists) duplicates across the whole stream. Pass an empty list
+    # as keep_masks to record which rows were kept, and the same list to later passes to reuse it instead of
+    # hashing every row again.
+    reuse = bool(keep_masks)
+    seen_keys = set()
+    for index, chunk in enumerate(iter_dataset_chunks(filepath, chunk_size, columns)):
+        if reuse:
+            keep = np.unpackbits(keep_masks[index], count=len(chunk)).astype(bool)
+            yield chunk[keep]
+            continue
+
+        keep = chunk.notna().all(axis=1).to_numpy(copy=True)
+        keys = pd.util.hash_pandas_object(chunk[keep][["name", "artists"]], index=False).to_numpy()
+        keep[keep] = get_new_keys_mask(keys, seen_keys)
+        if keep_masks is not None:
+            keep_masks.append(np.packbits(keep))
+        yield chunk[keep]
+
+
+def fit_streaming_pipeline(filepath, pipeline, chunk_size=100000, label_col=None, sample_size=100000, seed=0,
+                           keep_masks=None):
+    keep_masks = [] if keep_masks is None else keep_masks
+    stats = None
+    for chunk in iter_clean_chunks(filepath, chunk_size, keep_masks=keep_masks):
+        if stats is None:
+            numeric_cols = pipeline.numeric_cols or chunk.select_dtypes('number').columns.to_list()
+            stats = StreamingStats(numeric_cols, pipeline.categorical_cols, label_col, sample_size, seed)
+        stats.update(chunk)
+        log("COLLECTED STATS OF %s ROWS", stats.rows_cnt)
+
+    apply_streaming_stats(pipeline, stats)
+    if pipeline.bin_cols:
+        for chunk in iter_clean_chunks(filepath, chunk_size, keep_masks=keep_masks):
+            stats.update_ranges(chunk, pipeline)
+        apply_bin_ranges(pipeline, stats)
+    return pipeline, stats
+
+
+def to_feature_matrix(df, drop_cols=()):
+    features = df.drop(columns=list(drop_cols))
+    for col in features.select_dtypes("category"):
+        features[col] = features[col].cat.codes
+    return features.select_dtypes(["number", "bool"]).astype("float64")
+
+
+def train_streaming(filepath, pipeline, classifier, label_col, chunk_size=100000, drop_cols=(), sample_size=100000):
+    # First pass collects the cleaning statistics, second pass transforms each chunk and feeds partial_fit
+    keep_masks = []
+    pipeline, stats = fit_streaming_pipeline(filepath, pipeline, chunk_size, label_col, sample_size,
+                                             keep_masks=keep_masks)
+    classes = np.array(sorted(stats.labels))
+    trained_cnt = 0
+    for chunk in iter_clean_chunks(filepath, chunk_size, keep_masks=keep_masks):
+        transformed = pipeline.transform(chunk)
+        features = to_feature_matrix(transformed, [label_col, *drop_cols])
+        classifier.partial_fit(features, transformed[label_col], classes=classes)
+        trained_cnt += len(chunk)
+        log("TRAINED ON %s/%s ROWS", trained_cnt, stats.rows_cnt)
+
+    return classifier, pipeline
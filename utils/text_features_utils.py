@@ -0,0 +1,108 @@
+import time
+from functools import partial
+import numpy as np
+from utils.batch_utils import run_chunks, split_to_chunks
+from utils.lyrics_utils import LyricsHandler, is_lyrics_available
+from utils.metrics_utils import log, timed
+
+# scikit-learn and scipy are imported by the functions using them, like in ml_utils
+
+# 2^18 columns keep hash collisions rare for a corpus of a few thousand songs, the width does not grow with it
+TEXT_FEATURES_CNT = 2 ** 18
+# float32 halves the matrix, the tree classifiers convert their input to float32 anyway
+TEXT_FEATURES_DTYPE = np.float32
+
+
+def get_hashing_vectorizer(n_features=TEXT_FEATURES_CNT, ngram_range=(1, 2)):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    # clean_lyrics is already lower cased and stripped to letters, splitting on whitespace gives the same tokens
+    # as LyricsHandler.tokenized_lyrics. Raw counts, normalization is left to the TF-IDF step.
+    return HashingVectorizer(n_features=n_features, ngram_range=ngram_range, tokenizer=str.split,
+                             token_pattern=None, lowercase=False, alternate_sign=False, norm=None,
+                             dtype=TEXT_FEATURES_DTYPE)
+
+
+def hash_lyrics_chunk(lyrics_files, vectorizer):
+    # Runs inside a worker, the vectorizer is stateless so chunks are hashed independently
+    texts = [LyricsHandler(lyrics_file).clean_lyrics for lyrics_file in lyrics_files]
+    return lyrics_files, vectorizer.transform(texts)
+
+
+def hash_lyrics_batch(lyrics_files, vectorizer, workers=None, chunk_size=256):
+    # One row per entry of lyrics_files, in the same order. Missing files get an empty row.
+    import scipy.sparse as sp
+    unique_files = [f for f in dict.fromkeys(lyrics_files) if is_lyrics_available(f)]
+    chunks = split_to_chunks(unique_files, chunk_size)
+    log("HASHING %s LYRICS FILES IN %s CHUNKS", len(unique_files), len(chunks))
+
+    file_rows = {}
+    matrices = []
+    start = time.perf_counter()
+    for chunk_files, matrix in run_chunks(partial(hash_lyrics_chunk, vectorizer=vectorizer), chunks, workers):
+        file_rows.update(zip(chunk_files, range(len(file_rows), len(file_rows) + len(chunk_files))))
+        matrices.append(matrix)
+        log("HASHED %s/%s FILES (%.1f files/sec)", len(file_rows), len(unique_files),
+            len(file_rows) / (time.perf_counter() - start))
+
+    # The last row stays empty, it stands for every missing file
+    matrices.append(sp.csr_matrix((1, vectorizer.n_features), dtype=TEXT_FEATURES_DTYPE))
+    with timed("text_features_stack"):
+        stacked = sp.vstack(matrices, format="csr")
+        rows = np.fromiter((file_rows.get(f, len(file_rows)) for f in lyrics_files), dtype="int64",
+                           count=len(lyrics_files))
+        return stacked[rows]
+
+
+class LyricsTextFeaturizer:
+    # Hashed unigram/bigram counts of the clean lyrics, optionally TF-IDF weighted. No vocabulary is kept, the only
+    # fitted state is the IDF vector, so the featurizer is saved with the model it was trained with.
+    def __init__(self, n_features=TEXT_FEATURES_CNT, ngram_range=(1, 2), use_tfidf=True, workers=None,
+                 chunk_size=256):
+        self.vectorizer = get_hashing_vectorizer(n_features, ngram_range)
+        self.use_tfidf = use_tfidf
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.tfidf = None
+
+    def hash_lyrics(self, lyrics_files):
+        return hash_lyrics_batch(lyrics_files, self.vectorizer, self.workers, self.chunk_size)
+
+    def fit_transform(self, lyrics_files):
+        from sklearn.feature_extraction.text import TfidfTransformer
+        counts = self.hash_lyrics(lyrics_files)
+        if not self.use_tfidf:
+            return counts
+        # Log scaled counts, so a repeated chorus does not outweigh the rest of the song
+        self.tfidf = TfidfTransformer(sublinear_tf=True)
+        return self.tfidf.fit_transform(counts)
+
+    def fit(self, lyrics_files):
+        self.fit_transform(lyrics_files)
+        return self
+
+    def check_fitted(self):
+        # Checked before hashing, the IDF weights only exist after fit
+        if self.use_tfidf and self.tfidf is None:
+            from sklearn.exceptions import NotFittedError
+            raise NotFittedError("LyricsTextFeaturizer with use_tfidf=True is not fitted, call fit or fit_transform "
+                                 "first")
+
+    def transform(self, lyrics_files):
+        self.check_fitted()
+        counts = self.hash_lyrics(lyrics_files)
+        return self.tfidf.transform(counts) if self.use_tfidf else counts
+
+    def transform_texts(self, lyrics_texts):
+        # Raw lyrics that are not saved in a file, e.g. when predicting
+        self.check_fitted()
+        texts = [LyricsHandler.from_text(text).clean_lyrics for text in lyrics_texts]
+        counts = self.vectorizer.transform(texts)
+        return self.tfidf.transform(counts) if self.use_tfidf else counts
+
+
+def combine_features(numeric_features, text_features):
+    # Numeric columns first, then the hashed text columns, as one CSR matrix. Accepted as is by the KNN, svm,
+    # decision_tree and random_forest classifiers of ml_utils, naive_bayes (GaussianNB) needs dense input.
+    import scipy.sparse as sp
+    numeric = np.asarray(numeric_features, dtype=text_features.dtype)
+    return sp.hstack([sp.csr_matrix(numeric), text_features], format="csr")
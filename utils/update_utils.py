@@ -0,0 +1,124 @@
+import os.path as osp
+import time
+import pandas as pd
+from utils.batch_utils import extract_features_batch, merge_features
+from utils.checkpoint_utils import filter_unknown_tracks, get_known_tracks
+from utils.general_utls import is_dataset_store
+from utils.lyrics_utils import get_lyrics_hash, is_lyrics_available
+from utils.metrics_utils import count, log
+from utils.spotify_utils import fetch_tracks, fetch_tracks_data
+from utils.store_utils import ROW_ID_COLUMN, assign_row_ids, get_next_row_id, get_store_key_columns, \
+    load_dataset_store, save_dataset_partition
+
+
+def get_lyrics_mtime(lyrics_file):
+    # Lyrics only found in the packed archive have no mtime, their hash is checked every time
+    return osp.getmtime(lyrics_file) if osp.exists(lyrics_file) else None
+
+
+def open_update_store(store_dir):
+    if not is_dataset_store(store_dir):
+        raise ValueError(f"'{store_dir}' is a csv file, migrate it with utils.store_utils to update it in place")
+    # Rows are upserted by row id, (name, artists) has legitimate duplicates that must not replace each other
+    key_columns = get_store_key_columns(store_dir)
+    if key_columns is None:
+        assign_row_ids(store_dir)
+    elif key_columns != [ROW_ID_COLUMN]:
+        raise ValueError(f"'{store_dir}' is keyed on {key_columns}, updates need a store keyed on row ids")
+    return load_dataset_store(store_dir)
+
+
+def find_stale_rows(dataset_df):
+    # Returns (stale, adopted): rows whose lyrics content changed since their features were computed, and rows
+    # saved before the updater, which have no recorded hash yet. Adopted rows keep their features as current and
+    # only get their lyrics state recorded (recalculate_dataset redoes all). Files with an unchanged mtime are not
+    # read at all, files only touched (new mtime, same hash) are left alone and hashed again on the next run.
+    stored_hashes = dataset_df.get("lyrics_hash", pd.Series(None, index=dataset_df.index))
+    stored_mtimes = dataset_df.get("lyrics_mtime", pd.Series(None, index=dataset_df.index))
+    stale, adopted = {}, {}
+    for index, lyrics_file, stored_hash, stored_mtime in zip(
+            dataset_df.index, dataset_df["lyrics_file"], stored_hashes, stored_mtimes):
+        if not isinstance(lyrics_file, str) or not is_lyrics_available(lyrics_file):
+            continue
+        mtime = get_lyrics_mtime(lyrics_file)
+        if isinstance(stored_hash, str) and mtime is not None and mtime == stored_mtime:
+            continue
+
+        lyrics_hash = get_lyrics_hash(lyrics_file)
+        if not isinstance(stored_hash, str):
+            adopted[index] = (lyrics_hash, mtime)
+        elif lyrics_hash != stored_hash:
+            stale[index] = (lyrics_hash, mtime)
+
+    return stale, adopted
+
+
+def set_lyrics_state(rows_df, states):
+    rows_df = rows_df.copy()
+    rows_df["lyrics_hash"] = [states[index][0] for index in rows_df.index]
+    rows_df["lyrics_mtime"] = [states[index][1] for index in rows_df.index]
+    return rows_df
+
+
+def refresh_lyrics_features(store_dir, workers=None, chunk_size=64):
+    # Recomputes features only for rows whose lyrics changed and upserts them as a new partition
+    dataset_df = open_update_store(store_dir)
+    stale, adopted = find_stale_rows(dataset_df)
+    log("%s STALE AND %s ADOPTED ROWS OUT OF %s", len(stale), len(adopted), len(dataset_df))
+    if not stale and not adopted:
+        return 0
+
+    stale_df = dataset_df.loc[list(stale)]
+    if stale:
+        merge_features(stale_df, extract_features_batch(stale_df["lyrics_file"].tolist(), workers, chunk_size))
+    updated_df = pd.concat([set_lyrics_state(stale_df, stale),
+                            set_lyrics_state(dataset_df.loc[list(adopted)], adopted)])
+    save_dataset_partition(updated_df, store_dir)
+    count("rows_upserted", len(updated_df))
+    return len(updated_df)
+
+
+def ingest_new_tracks(store_dir, tracks, fetcher, source_genre=None, known_tracks=None):
+    # Fetches lyrics and features of tracks not in the store yet and appends those with lyrics as one partition.
+    # known_tracks, as returned by get_known_tracks, is updated with the added tracks.
+    known_ids, known_keys = known_tracks or get_known_tracks(open_update_store(store_dir))
+    new_tracks = filter_unknown_tracks(tracks, known_ids, known_keys)
+    log("%s OF %s TRACKS ALREADY IN DATASET", len(tracks) - len(new_tracks), len(tracks))
+    if not new_tracks:
+        return 0
+
+    rows = []
+    next_row_id = get_next_row_id(store_dir)
+    for track, track_data in zip(new_tracks, fetch_tracks_data(new_tracks, fetcher)):
+        # Like generate_dataset, tracks without lyrics are left out and stay unknown, the next update retries them.
+        # A row without lyrics would never be featurized, find_stale_rows skips it.
+        if track_data is None or not is_lyrics_available(track_data["lyrics_file"]):
+            count("skipped_tracks")
+            continue
+        lyrics_file = track_data["lyrics_file"]
+        lyrics_state = {"lyrics_hash": get_lyrics_hash(lyrics_file), "lyrics_mtime": get_lyrics_mtime(lyrics_file)}
+        rows.append({"source_genre": source_genre, **track_data, "spotify_id": track.get("id"), **lyrics_state,
+                     ROW_ID_COLUMN: next_row_id + len(rows)})
+        known_ids.add(track.get("id"))
+        known_keys.add((track_data["name"], track_data["artists"]))
+
+    if rows:
+        save_dataset_partition(rows, store_dir)
+        count("rows_upserted", len(rows))
+    return len(rows)
+
+
+def update_dataset(store_dir, fetcher, search_queries, limit=50, pages_cnt=1, workers=None):
+    # Daily refresh: new tracks of every {source_genre: query} are ingested, changed lyrics are re-featurized.
+    # The work done scales with the number of new and changed tracks, not with the size of the store.
+    start = time.perf_counter()
+    known_tracks = get_known_tracks(open_update_store(store_dir))
+    added_cnt = 0
+    for source_genre, query in search_queries.items():
+        for page in range(pages_cnt):
+            tracks = fetch_tracks(query, limit=limit, offset=page * limit)
+            added_cnt += ingest_new_tracks(store_dir, tracks, fetcher, source_genre, known_tracks)
+
+    refreshed_cnt = refresh_lyrics_features(store_dir, workers)
+    log("ADDED %s TRACKS AND REFRESHED %s ROWS IN %.1fs", added_cnt, refreshed_cnt, time.perf_counter() - start)
+    return added_cnt, refreshed_cnt